@@ -0,0 +1,69 @@
+"""比较两次基准测试的结果
+
+python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any
+
+METRICS = (
+    ("throughput_rps", None, "吞吐量(req/s)"),
+    ("latency", "p50_ms", "延迟 p50(ms)"),
+    ("latency", "p95_ms", "延迟 p95(ms)"),
+    ("latency", "p99_ms", "延迟 p99(ms)"),
+    ("first_output", "p50_ms", "首段回答 p50(ms)"),
+    ("loop_lag", "p99_ms", "事件循环延迟 p99(ms)"),
+    ("loop_lag", "max_ms", "事件循环延迟 max(ms)"),
+)
+
+
+def _value(level: dict[str, Any], key: str, field: str | None) -> float | None:
+    value = level.get(key)
+    if field is not None:
+        value = (value or {}).get(field)
+    return value
+
+
+def _row(name: str, before: float | None, after: float | None) -> str:
+    if before is None or after is None:
+        return f"  {name:<22} {before!s:>10} -> {after!s:>10}"
+    change = f"{(after - before) / before:+.1%}" if before else "-"
+    return f"  {name:<22} {before:>10.2f} -> {after:>10.2f}  {change:>8}"
+
+
+def compare(before: dict[str, Any], after: dict[str, Any]) -> list[str]:
+    lines = [f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}"]
+    if before.get("options") != after.get("options") or before.get("model") != after.get("model"):
+        lines.append("注意: 两次测试的参数不同")
+
+    after_levels = {level["concurrency"]: level for level in after["levels"]}
+    for level in before["levels"]:
+        if (other := after_levels.get(level["concurrency"])) is None:
+            continue
+        lines.append(f"并发 {level['concurrency']} (成功 {level['ok']}/{level['requests']} -> {other['ok']}/{other['requests']}):")
+        lines.extend(_row(name, _value(level, key, field), _value(other, key, field)) for key, field, name in METRICS)
+
+    rss_before, rss_after = before.get("peak_rss_bytes") or {}, after.get("peak_rss_bytes") or {}
+    lines.extend(
+        _row(f"内存峰值 {kind}(MB)", rss_before[kind] / 1024 / 1024, rss_after[kind] / 1024 / 1024)
+        for kind in ("self", "children")
+        if kind in rss_before and kind in rss_after
+    )
+    return lines
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="比较两次 zssm 基准测试的结果")
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    args = parser.parse_args(argv)
+
+    before = json.loads(args.before.read_text(encoding="utf-8"))
+    after = json.loads(args.after.read_text(encoding="utf-8"))
+    print("\n".join(compare(before, after)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""基准测试用的静态文件, 运行时生成, 不需要提交二进制文件"""
+
+import random
+from io import BytesIO
+
+import fitz  # PyMuPDF
+from PIL import Image as PILImage
+
+PARAGRAPH = "这是一段用于性能测试的网页正文，内容没有实际意义。解析器需要找出正文区域，忽略导航栏、页脚和脚本。"
+PDF_LINE = "Benchmark fixture text used to exercise layout analysis and section selection in the PDF pipeline."
+
+
+def html_page(paragraphs: int = 60) -> bytes:
+    """带导航、脚本和正文的网页, 正文足够长, 不会被判断为需要浏览器"""
+    body = "\n".join(f"<p>{i}. {PARAGRAPH}</p>" for i in range(paragraphs))
+    nav = "".join(f'<li><a href="/{i}">导航 {i}</a></li>' for i in range(30))
+    return f"""<!DOCTYPE html>
+<html lang="zh">
+<head><meta charset="utf-8"><title>基准测试页面</title><script>var data = {list(range(200))};</script></head>
+<body>
+<nav><ul>{nav}</ul></nav>
+<article><h1>基准测试页面</h1>
+{body}
+</article>
+<footer>页脚 · 版权所有</footer>
+</body>
+</html>
+""".encode()
+
+
+def pdf_document(pages: int = 20, lines_per_page: int = 40) -> bytes:
+    """带页眉页脚和目录的多页 PDF"""
+    doc = fitz.open()
+    toc = []
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_text((50, 30), "Benchmark Report - Confidential", fontsize=8)
+        if number % 5 == 0:
+            title = f"Chapter {number // 5 + 1}"
+            page.insert_text((50, 60), title, fontsize=16)
+            toc.append([1, title, number + 1])
+        for line in range(lines_per_page):
+            page.insert_text((50, 90 + line * 17), f"{line}. {PDF_LINE}", fontsize=9)
+        page.insert_text((280, 820), str(number + 1), fontsize=8)
+    doc.set_toc(toc)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def image(size: int = 1024, image_format: str = "PNG", seed: int = 0) -> bytes:
+    """带噪点的渐变图片, 噪点让压缩后的体积接近真实照片"""
+    rng = random.Random(seed)  # noqa: S311
+    gradient = PILImage.linear_gradient("L").resize((size, size))
+    noise = PILImage.frombytes("L", (size, size), rng.randbytes(size * size))
+    picture = PILImage.merge("RGB", (gradient, noise, gradient.rotate(90)))
+    buffer = BytesIO()
+    picture.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def build_fixtures(image_size: int = 1024, pdf_pages: int = 20) -> dict[str, tuple[str, bytes]]:
+    """路径 -> (Content-Type, 内容)"""
+    return {
+        "/page.html": ("text/html; charset=utf-8", html_page()),
+        "/doc.pdf": ("application/pdf", pdf_document(pdf_pages)),
+        "/image.png": ("image/png", image(image_size, "PNG")),
+        "/image.jpg": ("image/jpeg", image(image_size, "JPEG")),
+        "/notes.txt": ("text/plain; charset=utf-8", (PARAGRAPH * 40).encode()),
+    }
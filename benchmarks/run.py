@@ -0,0 +1,349 @@
+"""离线基准测试
+
+用本地的模拟模型服务和静态文件服务运行真实的 `construct_user_prompt` 和 `generate_ai_response`,
+输出各并发数下的延迟分位数、吞吐量、事件循环延迟和内存峰值
+
+    python -m benchmarks.run --concurrency 1 8 32 --requests 64 --output result.json
+    python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, NamedTuple, Self
+
+import nonebot
+
+from . import fixtures
+from .servers import MockModel, MockModelHandler, StaticHandler, base_url, start_server
+
+SCENARIOS = ("text", "text_url", "html", "pdf", "image")
+
+
+class Sample(NamedTuple):
+    scenario: str
+    latency: float
+    prompt_latency: float | None  # construct_user_prompt 的耗时
+    first_output: float | None  # 第一段回答发出的时间, 只在流式输出时记录
+    error: str | None
+
+
+def percentile(samples: list[float], p: float) -> float:
+    """最近秩分位数"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p * len(ordered)) - 1))]
+
+
+def summarize(samples: list[float]) -> dict[str, float] | None:
+    """各分位数, 单位毫秒"""
+    if not samples:
+        return None
+    return {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+def peak_rss() -> dict[str, int] | None:
+    """本进程和已结束的子进程(进程池)的内存峰值, 单位字节"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+
+    # Linux 上单位是 KB, macOS 上是字节
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+class LoopLagMonitor:
+    """定时休眠, 记录实际醒来时间比预期晚了多少"""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task[None] | None = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def __enter__(self) -> Self:
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+
+class _NoReply:
+    """没有回复消息时的 ReplyRecordExtension"""
+
+    def get_reply(self, msg_id: str) -> None:  # noqa: ARG002
+        return None
+
+
+# 当前请求发送过的消息, 子任务共享同一个列表
+_sent: ContextVar[list[str]] = ContextVar("sent")
+
+
+@contextlib.contextmanager
+def offline_chat() -> Iterator[None]:
+    """没有连接聊天平台, 发送消息改为记录到当前请求的 `_sent` 中, 表情回应直接忽略"""
+    from nonebot_plugin_alconna.uniseg import UniMessage
+
+    from nonebot_plugin_zssm import handle
+
+    async def send(self: UniMessage, *args: Any, **kwargs: Any) -> None:  # noqa: ARG001
+        _sent.get().append(str(self))
+
+    async def message_reaction(*args: Any, **kwargs: Any) -> None:
+        pass
+
+    patches = [(UniMessage, "send", send), (handle, "message_reaction", message_reaction)]
+    originals = [(target, name, getattr(target, name)) for target, name, _ in patches]
+    for target, name, value in patches:
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for target, name, value in originals:
+            setattr(target, name, value)
+
+
+def build_message(scenario: str, static_url: str) -> Any:
+    from nonebot_plugin_alconna.uniseg import Image, Text, UniMessage
+
+    match scenario:
+        case "text":
+            return UniMessage.text("yyds 是什么意思, 为什么大家都这么说")
+        case "text_url":
+            return UniMessage.text(f"这个文件里写的是什么 {static_url}/notes.txt")
+        case "html":
+            return UniMessage.text(f"这个网页讲了什么 {static_url}/page.html")
+        case "pdf":
+            return UniMessage.text(f"总结一下这篇报告 {static_url}/doc.pdf")
+        case "image":
+            return UniMessage([Text("这张图是什么"), Image(url=f"{static_url}/image.jpg")])
+    raise ValueError(f"未知的场景: {scenario}")
+
+
+async def run_request(scenario: str, static_url: str, *, stream: bool) -> Sample:
+    """按 `handle.respond` 的流程处理一个请求, 不经过调度器和回答缓存"""
+    from nonebot.exception import FinishedException
+    from nonebot_plugin_alconna import Match
+
+    from nonebot_plugin_zssm.config import plugin_config
+    from nonebot_plugin_zssm.constant import construct_system_prompt
+    from nonebot_plugin_zssm.handle import construct_user_prompt, fetch_images
+    from nonebot_plugin_zssm.metrics import new_trace
+    from nonebot_plugin_zssm.processors.ai import generate_ai_response
+
+    new_trace()
+    sent = []
+    _sent.set(sent)
+    started = time.perf_counter()
+    prompt_latency = first_output = None
+
+    async def on_output(chunk: str) -> None:  # noqa: ARG001
+        nonlocal first_output
+        if first_output is None:
+            first_output = time.perf_counter() - started
+
+    try:
+        random_number = random.randint(10000000, 99999999)  # noqa: S311
+        system_prompt = construct_system_prompt(random_number, is_mllm=plugin_config.text.is_mllm)
+        content = Match(build_message(scenario, static_url), available=True)
+        user_prompt, image_urls = await construct_user_prompt(None, "0", _NoReply(), content)  # type: ignore
+        prompt_latency = time.perf_counter() - started
+
+        images = await fetch_images(image_urls) if plugin_config.text.is_mllm else []
+        user_prompt = f"<random number: {random_number}>\n{user_prompt}\n</random number: {random_number}>"
+        response = await generate_ai_response(system_prompt, user_prompt, images, random_number, on_output if stream else None)
+        error = None if response is not None else "empty response"
+    except FinishedException:
+        # 处理流程中途结束时, 最后发送的消息就是原因
+        error = sent[-1] if sent else "finished"
+    except Exception as e:
+        error = repr(e)
+    return Sample(scenario, time.perf_counter() - started, prompt_latency, first_output, error)
+
+
+async def run_level(concurrency: int, total: int, scenarios: list[str], static_url: str, *, stream: bool) -> dict[str, Any]:
+    pending = iter([scenarios[i % len(scenarios)] for i in range(total)])
+    samples: list[Sample] = []
+
+    async def worker() -> None:
+        # 各个 worker 共用同一个迭代器, 谁空闲谁取下一个请求
+        samples.extend([await run_request(scenario, static_url, stream=stream) for scenario in pending])
+
+    with LoopLagMonitor() as monitor:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+
+    ok = [sample for sample in samples if sample.error is None]
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": dict(Counter(sample.error for sample in samples if sample.error is not None)),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 3),
+        "latency": summarize([sample.latency for sample in ok]),
+        "prompt_latency": summarize([sample.prompt_latency for sample in ok if sample.prompt_latency is not None]),
+        "first_output": summarize([sample.first_output for sample in ok if sample.first_output is not None]),
+        "scenarios": {scenario: summarize([sample.latency for sample in ok if sample.scenario == scenario]) for scenario in scenarios},
+        "loop_lag": summarize(monitor.samples),
+    }
+
+
+def format_level(level: dict[str, Any]) -> str:
+    latency = level["latency"] or {}
+    lag = level["loop_lag"] or {}
+    return (
+        f"并发 {level['concurrency']:>3}: {level['ok']}/{level['requests']} 成功, {level['throughput_rps']:.2f} req/s, "
+        f"延迟 p50 {latency.get('p50_ms', 0):.0f}ms p95 {latency.get('p95_ms', 0):.0f}ms p99 {latency.get('p99_ms', 0):.0f}ms, "
+        f"事件循环延迟 p99 {lag.get('p99_ms', 0):.1f}ms max {lag.get('max_ms', 0):.1f}ms"
+    )
+
+
+async def benchmark(args: argparse.Namespace, static_url: str) -> dict[str, Any]:
+    from nonebot_plugin_zssm.api import close_http_clients
+    from nonebot_plugin_zssm.worker import shutdown_pools
+
+    try:
+        # 预热: 进程池、编码器等在第一次使用时初始化, 不计入结果
+        for scenario in args.scenarios:
+            for _ in range(args.warmup):
+                if (sample := await run_request(scenario, static_url, stream=args.stream)).error is not None:
+                    print(f"预热失败: {scenario}, {sample.error}", file=sys.stderr)
+
+        levels = []
+        for concurrency in args.concurrency:
+            level = await run_level(concurrency, args.requests, args.scenarios, static_url, stream=args.stream)
+            print(format_level(level), file=sys.stderr)
+            levels.append(level)
+    finally:
+        await close_http_clients()
+        await shutdown_pools()
+
+    return {"levels": levels, "peak_rss_bytes": peak_rss()}
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="zssm 离线基准测试")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="依次测试的并发数")
+    parser.add_argument("--requests", type=int, default=64, help="每个并发数下的请求总数")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="轮流使用的请求类型")
+    parser.add_argument("--warmup", type=int, default=1, help="每种请求的预热次数")
+    parser.add_argument("--stream", action="store_true", help="开启分段发送, 记录第一段回答的延迟")
+    parser.add_argument("--mllm", action="store_true", help="以多模态模型运行, 图片直接发送给回答模型")
+    parser.add_argument("--cache", action="store_true", help="保留链接和图片描述缓存, 默认关闭以测量完整流程")
+    parser.add_argument("--ttft", type=float, default=0.5, help="模拟模型的首字延迟(秒)")
+    parser.add_argument("--tps", type=float, default=200.0, help="模拟模型每秒输出的 token 数")
+    parser.add_argument("--chunk-tokens", type=int, default=2, help="每个 SSE 事件包含的 token 数")
+    parser.add_argument("--reasoning-tokens", type=int, default=0, help="回答前输出的思考内容 token 数")
+    parser.add_argument("--answer-tokens", type=int, default=300, help="回答的 token 数")
+    parser.add_argument("--image-size", type=int, default=1024, help="测试图片的边长(像素)")
+    parser.add_argument("--pdf-pages", type=int, default=20, help="测试 PDF 的页数")
+    parser.add_argument("--log-level", default="WARNING", help="nonebot 日志级别")
+    parser.add_argument("--output", type=Path, help="结果 JSON 的保存路径, 默认输出到标准输出")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    model = MockModel(args.ttft, args.tps, args.chunk_tokens, args.reasoning_tokens, args.answer_tokens)
+    model_server = start_server(MockModelHandler, model=model)
+    static_server = start_server(StaticHandler, fixtures=fixtures.build_fixtures(args.image_size, args.pdf_pages))
+    model_url, static_url = base_url(model_server), base_url(static_server)
+
+    endpoint = {"endpoint": f"{model_url}/v1", "token": "benchmark", "model": "mock"}
+    nonebot.init(
+        driver="~none",
+        log_level=args.log_level,
+        zssm={
+            "text": {**endpoint, "is_mllm": args.mllm},
+            "vl": endpoint,
+            "browser": {"install_on_startup": False},
+            "url": {"cache": {"enabled": args.cache}},
+            "image": {"cache": {"enabled": args.cache}},
+            "stream": {"mode": "chunk" if args.stream else "off"},
+        },
+    )
+    nonebot.load_plugin("nonebot_plugin_zssm")
+
+    with offline_chat():
+        result = asyncio.run(benchmark(args, static_url))
+    model_server.shutdown()
+    static_server.shutdown()
+
+    from nonebot_plugin_zssm import __version__
+
+    report = {
+        "meta": {
+            "version": __version__,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "options": {
+            "scenarios": args.scenarios,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "stream": args.stream,
+            "mllm": args.mllm,
+            "cache": args.cache,
+            "image_size": args.image_size,
+            "pdf_pages": args.pdf_pages,
+        },
+        "model": model._asdict(),
+        **result,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
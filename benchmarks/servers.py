@@ -0,0 +1,123 @@
+"""基准测试用的本地服务: OpenAI 兼容的模拟模型服务和静态文件服务
+
+两者都在独立线程中运行, 不占用被测插件的事件循环
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+
+ANSWER_SENTENCE = "这是一段用于性能测试的模拟回答，内容没有实际意义。"
+REASONING_SENTENCE = "先理解用户给出的内容，再组织回答。"
+DESCRIPTION_SENTENCE = "图片中是一块由渐变和噪点组成的测试图案。"
+
+
+class MockModel(NamedTuple):
+    ttft: float = 0.5  # 首个数据块前的等待时间(秒)
+    tokens_per_second: float = 50.0
+    chunk_tokens: int = 1  # 每个 SSE 事件包含的 token 数
+    reasoning_tokens: int = 0  # 回答前输出的思考内容 token 数
+    answer_tokens: int = 300  # 回答的 token 数, 按每个字符一个 token 计算
+
+
+def _repeat(sentence: str, length: int) -> str:
+    return (sentence * (length // len(sentence) + 1))[:length]
+
+
+def _split(text: str, size: int) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    model: MockModel
+    fixtures: dict[str, tuple[str, bytes]]
+    requests = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _Server
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        pass
+
+    def _send_body(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockModelHandler(_Handler):
+    def do_POST(self) -> None:
+        if not self.path.endswith("/chat/completions"):
+            self._send_body(404, "application/json", b'{"message": "not found"}')
+            return
+
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.server.requests += 1
+        model = self.server.model
+
+        if not payload.get("stream"):
+            # 插件中只有泄露审查使用非流式请求
+            time.sleep(model.ttft)
+            message = {"role": "assistant", "content": '{"leaked": false}'}
+            body = json.dumps({"choices": [{"index": 0, "message": message, "finish_reason": "stop"}]})
+            self._send_body(200, "application/json", body.encode())
+            return
+
+        # 带 system prompt 的是回答请求, 其余的是图片描述请求
+        if any(message.get("role") == "system" for message in payload.get("messages", [])):
+            answer = {"block": False, "keyword": ["测试"], "output": _repeat(ANSWER_SENTENCE, model.answer_tokens)}
+            content = json.dumps(answer, ensure_ascii=False)
+        else:
+            content = _repeat(DESCRIPTION_SENTENCE, model.answer_tokens)
+        reasoning = _repeat(REASONING_SENTENCE, model.reasoning_tokens)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(model.ttft)
+        interval = model.chunk_tokens / model.tokens_per_second
+        events = [("reasoning_content", piece) for piece in _split(reasoning, model.chunk_tokens)]
+        events += [("content", piece) for piece in _split(content, model.chunk_tokens)]
+        for i, (field, piece) in enumerate(events):
+            if i:
+                time.sleep(interval)
+            self._write_event(json.dumps({"choices": [{"index": 0, "delta": {field: piece}}]}, ensure_ascii=False))
+        self._write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_event(self, data: str) -> None:
+        event = f"data: {data}\n\n".encode()
+        self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+        self.wfile.flush()
+
+
+class StaticHandler(_Handler):
+    def do_GET(self) -> None:
+        self.server.requests += 1
+        if (fixture := self.server.fixtures.get(self.path)) is None:
+            self._send_body(404, "text/plain", b"not found")
+            return
+        self._send_body(200, *fixture)
+
+
+def start_server(handler: type[_Handler], **attributes: object) -> _Server:
+    """在后台线程中启动服务, 监听随机端口"""
+    server = _Server(("127.0.0.1", 0), handler)
+    for name, value in attributes.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, name=handler.__name__, daemon=True).start()
+    return server
+
+
+def base_url(server: _Server) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
@@ -4,9 +4,13 @@ from nonebot import get_driver, require
 from nonebot.plugin import PluginMetadata, inherit_supported_adapters
 
 require("nonebot_plugin_alconna")
+require("nonebot_plugin_localstore")
 from . import handle as handle
-from .browser import install_browser
+from .api import close_http_clients, init_http_clients
+from .browser import install_browser, prewarm_browser, shutdown_browser
 from .config import Config, plugin_config
+from .metrics import setup_metrics
+from .worker import shutdown_pools
 
 try:
     __version__ = version("nonebot_plugin_zssm")
@@ -25,5 +29,22 @@ __plugin_meta__ = PluginMetadata(
     extra={"author": "djkcyl", "version": __version__},
 )
 
-if plugin_config.browser.install_on_startup:
-    get_driver().on_startup(install_browser)
+driver = get_driver()
+# 路由需要在服务启动前注册
+setup_metrics(driver)
+
+
+@driver.on_startup
+async def _() -> None:
+    await init_http_clients(plugin_config.text, plugin_config.vl, plugin_config.check)
+
+    # 预热需要在安装完成后进行
+    if plugin_config.browser.install_on_startup:
+        await install_browser()
+    if plugin_config.browser.prewarm:
+        await prewarm_browser()
+
+
+driver.on_shutdown(close_http_clients)
+driver.on_shutdown(shutdown_pools)
+driver.on_shutdown(shutdown_browser)
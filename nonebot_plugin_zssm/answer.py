@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import re
+from collections.abc import Awaitable, Callable
+
+from nonebot_plugin_localstore import get_plugin_data_file
+
+from .cache import TieredCache
+from .config import plugin_config
+from .log import logger
+
+config = plugin_config.answer
+
+PATTERN_IMAGE_ID = re.compile(r"(<\/?type: image), id: -?\d+>")
+PATTERN_IMAGE_DISPLAY = re.compile(r"\[图片 -?\d+\]")
+PATTERN_WHITESPACE = re.compile(r"\s+")
+
+answer_cache = TieredCache(
+    "回答",
+    max_entries=config.max_entries,
+    ttl=config.ttl,
+    disk_path=get_plugin_data_file("answer_cache.db") if config.disk else None,
+    disk_max_entries=config.disk_max_entries,
+)
+
+_inflight: dict[str, asyncio.Future[str | None]] = {}
+
+
+def answer_key(system_prompt: str, user_prompt: str, image_digests: list[str]) -> str:
+    """根据提示内容、图片内容和模型配置计算回答的缓存键
+
+    Args:
+        system_prompt: 去掉随机数后的系统提示
+        user_prompt: 包裹随机数标记之前的用户提示
+        image_digests: 以附件形式发送的图片的内容哈希
+    """
+    # 图片 id 来自图片链接的 hash(), 同一张图在不同消息中的链接不同, 重启后 hash() 的结果也会变
+    user_prompt = PATTERN_IMAGE_DISPLAY.sub("[图片]", PATTERN_IMAGE_ID.sub(r"\1>", user_prompt))
+    user_prompt = PATTERN_WHITESPACE.sub(" ", user_prompt).strip()
+    text_config = plugin_config.text
+    parts = [text_config.endpoint, text_config.name, str(text_config.is_mllm), system_prompt, user_prompt, *image_digests]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+async def get_or_generate(key: str, generate: Callable[[], Awaitable[str | None]]) -> str | None:
+    """返回缓存的回答, 没有缓存时生成
+
+    相同的请求同时到达时只生成一次, 其余请求等待同一个结果
+    """
+    if not config.enabled:
+        return await generate()
+
+    if (cached := await answer_cache.get(key)) is not None:
+        logger.info(f"回答命中缓存: {key[:16]}" + (f", {answer_cache.stats}" if config.log_stats else ""))
+        return cached
+
+    if (future := _inflight.get(key)) is not None:
+        logger.info(f"相同的请求正在处理, 等待结果: {key[:16]}")
+        return await asyncio.shield(future)
+
+    future = _inflight[key] = asyncio.get_running_loop().create_future()
+    try:
+        answer = await generate()
+        if answer is not None:
+            await answer_cache.set(key, answer)
+        future.set_result(answer)
+        return answer
+    finally:
+        # 生成失败或被取消时, 等待中的请求得到 None
+        if not future.done():
+            future.set_result(None)
+        _inflight.pop(key, None)
@@ -1,35 +1,148 @@
+import asyncio
 import json
-from typing import Any, AsyncGenerator, NoReturn, Self, TypedDict
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncGenerator, NamedTuple, NoReturn, Self, TypedDict
 
 import httpx
-from nonebot.log import logger
 
-from .config import LLMConfig
+from .config import LLMConfig, LLMEndpointConfig, plugin_config
+from .log import logger
+from .tokens import count_tokens
+
+_clients: dict[tuple[str, str], httpx.AsyncClient] = {}
+
+# 限流、超时和服务端错误可以重试, 其余 4xx 重试也不会成功
+TRANSIENT_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
 
 
 class APIError(Exception):
     """基础API异常类"""
 
-    def __init__(self, message: str, code: int | None = None):
+    def __init__(self, message: str, code: int | None = None, *, transient: bool = False, retry_after: float | None = None):
         self.code = code
         self.message = message
+        self.transient = transient or code in TRANSIENT_STATUS
+        self.retry_after = retry_after
         super().__init__(f"[{code}] {message}" if code else message)
 
 
+class APITimeoutError(APIError):
+    """连接、首字节、流式间隔或总时长超时"""
+
+    def __init__(self, message: str):
+        super().__init__(message, transient=True)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """解析 Retry-After 头, 支持秒数和 HTTP 日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
 class CompletionMessage(TypedDict):
     role: str
     content: str | list[dict[str, Any]]
 
 
-class AsyncChatClient:
-    config: LLMConfig
-    content: str
+def _create_http_client() -> httpx.AsyncClient:
+    config = plugin_config.http
+    return httpx.AsyncClient(
+        http2=config.http2,
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+    )
+
+
+def get_http_client(config: LLMEndpointConfig) -> httpx.AsyncClient:
+    """获取端点共享的 HTTP 客户端, 同一端点的请求复用连接池"""
+    key = (config.endpoint, config.token)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        client = _clients[key] = _create_http_client()
+    return client
+
+
+async def init_http_clients(*configs: LLMConfig | None) -> None:
+    for config in configs:
+        if config is not None:
+            for endpoint in (config, *config.backups):
+                get_http_client(endpoint)
+
+
+async def close_http_clients() -> None:
+    clients = [*_clients.values()]
+    _clients.clear()
+    await asyncio.gather(*(client.aclose() for client in clients))
+
+
+class StreamDelta(NamedTuple):
+    """流式响应中单个 SSE 事件携带的增量内容"""
+
     reasoning_content: str
+    content: str
+
+
+class TextAccumulator:
+    """以列表收集增量文本, 读取时才合并, 避免反复拼接字符串"""
+
+    def __init__(self) -> None:
+        self._parts: list[str] = []
+
+    def append(self, text: str) -> None:
+        if text:
+            self._parts.append(text)
+
+    def getvalue(self) -> str:
+        if len(self._parts) > 1:
+            self._parts[:] = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
 
-    def __init__(self, config: LLMConfig, timeout: int = 120) -> None:
+
+class AsyncChatClient:
+    """OpenAI 兼容的对话客户端
+
+    请求受 `retry` 配置的超时限制: 连接、首个数据、流式数据间隔和总时长分别计时;
+    可重试的错误按指数退避加随机抖动重试, 并遵守 Retry-After, 流式请求只在产出内容前重试
+    """
+
+    config: LLMEndpointConfig
+
+    def __init__(self, config: LLMEndpointConfig, timeout: float | None = None) -> None:
         self.config = config
-        self.timeout = timeout
-        self._client = httpx.AsyncClient()
+        self.policy = plugin_config.retry
+        self.timeout = timeout or self.policy.total_timeout
+        self._client = get_http_client(config)
+        self._content = TextAccumulator()
+        self._reasoning_content = TextAccumulator()
+        self._usage_tokens: int | None = None
+
+    @property
+    def content(self) -> str:
+        return self._content.getvalue()
+
+    @property
+    def reasoning_content(self) -> str:
+        return self._reasoning_content.getvalue()
+
+    @property
+    def completion_tokens(self) -> int:
+        """最近一次流式回答的 token 数, 服务端返回了用量时直接使用, 否则按配置的分词方式计算"""
+        if self._usage_tokens is not None:
+            return self._usage_tokens
+        return count_tokens(self.reasoning_content + self.content)
 
     async def __aenter__(self) -> Self:
         return self
@@ -38,7 +151,8 @@ class AsyncChatClient:
         await self.close()
 
     async def close(self) -> None:
-        await self._client.aclose()
+        # 连接池由所有请求共享, 在驱动器关闭时统一释放
+        pass
 
     def _build_headers(self) -> dict[str, str]:
         return {
@@ -46,52 +160,125 @@ class AsyncChatClient:
             "Content-Type": "application/json",
         }
 
+    def _timeout(self, deadline: float, phase: float) -> httpx.Timeout:
+        remaining = max(0.001, deadline - time.monotonic())
+        return httpx.Timeout(min(phase, remaining), connect=min(self.policy.connect_timeout, remaining))
+
+    async def _backoff(self, error: Exception, attempt: int, deadline: float) -> bool:
+        """等待下一次重试, 不应重试时返回 False"""
+        transient = isinstance(error, httpx.TransportError) or (isinstance(error, APIError) and error.transient)
+        if not transient or attempt >= self.policy.max_retries:
+            return False
+
+        if isinstance(error, APIError) and error.retry_after is not None:
+            delay = error.retry_after
+        else:
+            # 完全随机抖动, 避免大量请求同时重试
+            delay = random.uniform(0, min(self.policy.backoff_max, self.policy.backoff_base * 2**attempt))  # noqa: S311
+        if time.monotonic() + delay >= deadline:
+            return False
+
+        logger.warning(f"请求 {self.config.name} 失败, {delay:.1f}s 后重试({attempt + 1}/{self.policy.max_retries}): {error!r}")
+        await asyncio.sleep(delay)
+        return True
+
     async def create(self, *messages: CompletionMessage, **kwargs: Any) -> dict:
         """发起非流式请求并返回解析后的响应"""
         url = f"{self.config.endpoint}/chat/completions"
         payload = {"model": self.config.name, "messages": [*messages], "stream": False, **kwargs}
+        deadline = time.monotonic() + self.timeout
 
-        response = await self._client.post(
-            url,
-            headers=self._build_headers(),
-            json=payload,
-            timeout=self.timeout,
-        )
+        attempt = 0
+        while True:
+            try:
+                response = await self._client.post(
+                    url,
+                    headers=self._build_headers(),
+                    json=payload,
+                    timeout=self._timeout(deadline, self.timeout),
+                )
+                if response.status_code != 200:
+                    self._handle_error(response)
+                return response.json()
+            except (httpx.TransportError, APIError) as e:  # noqa: PERF203
+                if not await self._backoff(e, attempt, deadline):
+                    if isinstance(e, httpx.TimeoutException):
+                        raise APITimeoutError(f"请求超时: {e!r}") from e
+                    raise
+                attempt += 1
 
-        if response.status_code != 200:
-            self._handle_error(response)
+    async def stream_create(self, *messages: CompletionMessage, **kwargs: Any) -> AsyncGenerator[str, None]:
+        """发起流式请求, 每次产出当前完整的 思考内容+回复内容 快照
 
-        return response.json()
+        每次快照都会复制已有内容, 仅为兼容保留, 新代码请使用 `stream_delta`
+        """
+        async for _ in self.stream_delta(*messages, **kwargs):
+            yield self.reasoning_content + self.content
 
-    async def stream_create(self, *messages: CompletionMessage, **kwargs: Any) -> AsyncGenerator[str, None]:
-        """发起流式请求并返回异步生成器"""
+    async def stream_delta(self, *messages: CompletionMessage, **kwargs: Any) -> AsyncGenerator[StreamDelta, None]:
+        """发起流式请求, 逐个产出增量内容, 完整内容可在结束后通过 `content` 获取"""
+        deadline = time.monotonic() + self.timeout
+
+        attempt = 0
+        while True:
+            produced = False
+            try:
+                async for delta in self._stream_once(messages, kwargs, deadline):
+                    produced = True
+                    yield delta
+            except (httpx.TransportError, APIError) as e:
+                # 已经产出的内容无法撤回, 只能在产出前重试
+                if produced or not await self._backoff(e, attempt, deadline):
+                    if isinstance(e, httpx.TimeoutException):
+                        raise APITimeoutError(f"请求超时: {e!r}") from e
+                    raise
+                attempt += 1
+            else:
+                return
+
+    async def _stream_once(
+        self, messages: tuple[CompletionMessage, ...], kwargs: dict[str, Any], deadline: float
+    ) -> AsyncGenerator[StreamDelta, None]:
         url = f"{self.config.endpoint}/chat/completions"
         payload = {"model": self.config.name, "messages": [*messages], "stream": True, **kwargs}
-        self.content = ""
-        self.reasoning_content = ""
+        self._content = TextAccumulator()
+        self._reasoning_content = TextAccumulator()
+        self._usage_tokens = None
 
         async with self._client.stream(
             "POST",
             url,
             headers=self._build_headers(),
             json=payload,
-            timeout=self.timeout,
+            timeout=self._timeout(deadline, self.policy.first_byte_timeout),
         ) as resp:
             if resp.status_code != 200:
                 await resp.aread()
                 self._handle_error(resp)
 
-            async for chunk in resp.aiter_lines():
-                if (data := self._parse_stream_chunk(chunk)) is None:
+            lines = resp.aiter_lines()
+            # 第一行数据前可能要等待模型排队和思考, 之后每行的间隔超过 idle_timeout 即视为卡住
+            phase, limit = "首个数据", self.policy.first_byte_timeout
+            while True:
+                wait = min(limit, deadline - time.monotonic())
+                try:
+                    chunk = await asyncio.wait_for(anext(lines), max(0.001, wait))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    reason = "总时长" if wait < limit else phase
+                    raise APITimeoutError(f"等待{reason}超时({wait:.1f}s)") from None
+                phase, limit = "流式数据", self.policy.idle_timeout
+
+                if (delta := self._parse_stream_chunk(chunk)) is None:
                     continue
 
                 # 更新内容
-                reasoning_content, content = data
-                self.reasoning_content += reasoning_content
-                self.content += content
-                yield self.reasoning_content + self.content
+                self._reasoning_content.append(delta.reasoning_content)
+                self._content.append(delta.content)
+                yield delta
 
-    def _parse_stream_chunk(self, chunk: str) -> tuple[str, str] | None:
+    def _parse_stream_chunk(self, chunk: str) -> StreamDelta | None:
         if not chunk.startswith("data:") or (data_str := chunk[6:].strip()) == "[DONE]":
             return None
 
@@ -101,9 +288,15 @@ class AsyncChatClient:
             logger.error(f"Failed to parse stream chunk: {chunk}")
             return None
 
-        choice: dict[str, dict] = data["choices"][0]
+        # 部分服务端在最后的数据块中附带用量, 开启 include_usage 时该数据块的 choices 为空
+        if isinstance(usage := data.get("usage"), dict) and isinstance(tokens := usage.get("completion_tokens"), int):
+            self._usage_tokens = tokens
+        if not (choices := data.get("choices")):
+            return None
+
+        choice: dict[str, dict] = choices[0]
         delta: dict[str, str] = choice.get("delta", {})
-        return delta.get("reasoning_content") or "", delta.get("content") or ""
+        return StreamDelta(delta.get("reasoning_content") or "", delta.get("content") or "")
 
     def _handle_error(self, response: httpx.Response) -> NoReturn:
         """统一错误处理"""
@@ -114,4 +307,9 @@ class AsyncChatClient:
         except Exception:
             message = f"HTTP Error {response.status_code}"
             code = response.status_code
-        raise APIError(message, code)
+        raise APIError(
+            message,
+            code,
+            transient=response.status_code in TRANSIENT_STATUS,
+            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+        )
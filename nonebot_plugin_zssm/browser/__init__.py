@@ -1,4 +1,5 @@
 from .browser import get_browser
 from .installer import install_browser
+from .pool import page_pool, prewarm_browser, shutdown_browser
 
-__all__ = ["get_browser", "install_browser"]
+__all__ = ["get_browser", "install_browser", "page_pool", "prewarm_browser", "shutdown_browser"]
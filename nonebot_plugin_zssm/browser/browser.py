@@ -1,11 +1,15 @@
-from nonebot import logger, require
+import asyncio
+
+from nonebot import require
 from playwright.async_api import Browser, BrowserType, Error, Playwright, async_playwright
 
 from ..config import plugin_config
+from ..log import logger
 from .installer import install_browser
 
 _browser: Browser | None = None
 _playwright: Playwright | None = None
+_lock = asyncio.Lock()
 
 
 async def init(**kwargs) -> Browser:
@@ -42,4 +46,24 @@ async def launch_browser(**kwargs) -> Browser:
 
 
 async def get_browser(**kwargs) -> Browser:
-    return _browser if _browser and _browser.is_connected() else await init(**kwargs)
+    if _browser and _browser.is_connected():
+        return _browser
+
+    # 并发的首次请求只启动一个浏览器
+    async with _lock:
+        return _browser if _browser and _browser.is_connected() else await init(**kwargs)
+
+
+async def close_browser() -> None:
+    global _browser, _playwright  # noqa: PLW0603
+
+    async with _lock:
+        if _browser is not None:
+            try:
+                await _browser.close()
+            except Error as e:
+                logger.warning(f"关闭浏览器失败: {e!r}")
+            _browser = None
+        if _playwright is not None:
+            await _playwright.stop()
+            _playwright = None
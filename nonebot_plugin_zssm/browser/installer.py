@@ -3,10 +3,10 @@ import os
 import re
 import sys
 
-from nonebot import logger
 from playwright._impl._driver import compute_driver_executable, get_driver_env  # pyright:ignore[reportPrivateImportUsage]
 
 from ..config import plugin_config
+from ..log import logger
 
 
 def log(level: str, rich_text: str) -> None:
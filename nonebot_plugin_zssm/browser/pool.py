@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+from collections.abc import AsyncGenerator
+
+from playwright.async_api import Browser, BrowserContext, Page, Route
+from yarl import URL
+
+from ..config import plugin_config
+from ..log import logger
+from .browser import close_browser, get_browser
+
+config = plugin_config.browser
+
+
+def get_proxy() -> dict[str, str | None] | None:
+    if not config.proxy:
+        return None
+
+    proxy_uri = URL(config.proxy)
+    return {
+        "server": f"{proxy_uri.scheme}://{proxy_uri.host}:{proxy_uri.port}",
+        "username": proxy_uri.user,
+        "password": proxy_uri.password,
+    }
+
+
+async def _block_resources(route: Route) -> None:
+    if route.request.resource_type in config.blocked_resources:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+class PooledPage:
+    def __init__(self, browser: Browser, context: BrowserContext, page: Page) -> None:
+        self.browser = browser
+        self.context = context
+        self.page = page
+        self.uses = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.browser.is_connected() and not self.page.is_closed()
+
+    async def heap_size(self) -> int:
+        # performance.memory 只有 chromium 支持, 其余浏览器返回 0
+        with contextlib.suppress(Exception):
+            return await self.page.evaluate("() => performance.memory ? performance.memory.usedJSHeapSize : 0")
+        return 0
+
+    async def reset(self) -> bool:
+        """清除上一次使用留下的状态, 返回 False 表示无法清除干净, 需要重新创建上下文"""
+        # localStorage 和 IndexedDB 无法按来源逐个清除, 网页写入过时只能丢弃整个上下文
+        state = await self.context.storage_state(indexed_db=True)
+        if state["origins"]:
+            return False
+
+        # 新的标签页没有 sessionStorage 和历史记录
+        await self.page.close()
+        self.page = await self.context.new_page()
+        await self.context.clear_cookies()
+        await self.context.clear_permissions()
+        return True
+
+    async def close(self) -> None:
+        with contextlib.suppress(Exception):
+            await self.context.close()
+
+
+class PagePool:
+    """预先创建的隔离页面池
+
+    每个页面有独立的上下文, 同时打开的页面数不超过 `size`, 超出的请求排队等待;
+    归还时换用新的标签页并清除 cookie, 网页写入过 localStorage/IndexedDB 时重新创建上下文, 不同请求之间不共享状态;
+    页面使用 `max_uses` 次或 JS 堆超过 `max_heap` MB 后重新创建
+    """
+
+    def __init__(self, size: int, max_uses: int, max_heap: int) -> None:
+        self.size = size
+        self.max_uses = max_uses
+        self.max_heap = max_heap * 1024 * 1024
+        self._idle: list[PooledPage] = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _create(self) -> PooledPage:
+        browser = await get_browser(proxy=get_proxy())
+        # 拦截 Service Worker, 避免其缓存在复用的上下文中残留
+        context = await browser.new_context(service_workers="block")
+        try:
+            if config.navigation == "text" and config.blocked_resources:
+                await context.route("**/*", _block_resources)
+            page = await context.new_page()
+        except Exception:
+            await context.close()
+            raise
+        return PooledPage(browser, context, page)
+
+    async def _take(self) -> PooledPage:
+        while self._idle:
+            pooled = self._idle.pop()
+            if pooled.alive:
+                return pooled
+            await pooled.close()
+        return await self._create()
+
+    async def _release(self, pooled: PooledPage, *, healthy: bool) -> None:
+        pooled.uses += 1
+        if not healthy or not pooled.alive:
+            await pooled.close()
+            return
+
+        if pooled.uses >= self.max_uses:
+            logger.debug(f"页面已使用 {pooled.uses} 次, 重新创建")
+            await pooled.close()
+            return
+
+        if self.max_heap and (heap := await pooled.heap_size()) > self.max_heap:
+            logger.debug(f"页面 JS 堆占用 {heap / 1024 / 1024:.1f}MB, 重新创建")
+            await pooled.close()
+            return
+
+        try:
+            reset = await pooled.reset()
+        except Exception:
+            logger.opt(exception=True).debug("重置页面失败, 重新创建")
+            await pooled.close()
+            return
+
+        if not reset:
+            logger.debug("页面写入了本地存储, 重新创建")
+            await pooled.close()
+            return
+        self._idle.append(pooled)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncGenerator[Page, None]:
+        """借出一个空白页面, 使用完毕后自动重置并归还"""
+        if self._slots.locked():
+            logger.info("浏览器页面已全部占用, 排队等待")
+
+        async with self._slots:
+            pooled = await self._take()
+            healthy = False
+            try:
+                yield pooled.page
+                healthy = True
+            finally:
+                await self._release(pooled, healthy=healthy)
+
+    async def warm(self) -> None:
+        """预先创建页面, 避免首次请求时等待"""
+        while len(self._idle) < self.size:
+            self._idle.append(await self._create())
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(pooled.close() for pooled in idle))
+
+
+page_pool = PagePool(config.pool_size, config.page_max_uses, config.page_max_heap)
+
+
+async def prewarm_browser() -> None:
+    """启动浏览器并预先创建页面"""
+    try:
+        await page_pool.warm()
+    except Exception:
+        logger.exception("预热浏览器失败")
+    else:
+        logger.success(f"浏览器已预热, 页面数: {page_pool.size}")
+
+
+async def shutdown_browser() -> None:
+    await page_pool.close()
+    await close_browser()
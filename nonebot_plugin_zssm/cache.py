@@ -0,0 +1,168 @@
+import asyncio
+import contextlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Generic, TypeVar
+
+from .log import logger
+
+T = TypeVar("T")
+
+caches: list["TieredCache"] = []
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self) -> str:
+        return f"命中 {self.hits} (磁盘 {self.disk_hits}) / 未命中 {self.misses}, 命中率 {self.hit_rate:.1%}"
+
+
+class LRUCache(Generic[T]):
+    """带过期时间的内存 LRU 缓存"""
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, T]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> T | None:
+        if (item := self._data.get(key)) is None:
+            return None
+
+        expires, value = item
+        if expires < time.time():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: T, ttl: float | None = None) -> None:
+        self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str) -> T | None:
+        item = self._data.pop(key, None)
+        return None if item is None else item[1]
+
+
+class SqliteCache:
+    """基于 SQLite 的磁盘缓存, 按最近访问时间淘汰
+
+    所有操作都是同步的, 请通过 `asyncio.to_thread` 调用
+    """
+
+    def __init__(self, path: Path, max_entries: int, ttl: float) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextlib.contextmanager
+    def _connect(self):
+        with self._lock, contextlib.closing(sqlite3.connect(self.path)) as conn, conn:
+            if not self._initialized:
+                conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON cache (accessed)")
+                self._initialized = True
+            yield conn
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, value, expires, now))
+            conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class TieredCache:
+    """内存 LRU + 可选磁盘的两级字符串缓存"""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        max_entries: int,
+        ttl: float,
+        disk_path: Path | None = None,
+        disk_max_entries: int = 0,
+    ) -> None:
+        self.name = name
+        self.stats = CacheStats()
+        self.memory: LRUCache[str] = LRUCache(max_entries, ttl)
+        self.disk = SqliteCache(disk_path, disk_max_entries, ttl) if disk_path is not None else None
+        caches.append(self)
+
+    async def get(self, key: str) -> str | None:
+        if (value := self.memory.get(key)) is not None:
+            self.stats.hits += 1
+            return value
+
+        if self.disk is not None:
+            try:
+                value = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error:
+                logger.exception(f"读取{self.name}磁盘缓存失败")
+            else:
+                if value is not None:
+                    self.stats.hits += 1
+                    self.stats.disk_hits += 1
+                    self.memory.set(key, value)
+                    return value
+
+        self.stats.misses += 1
+        return None
+
+    async def set(self, key: str, value: str, ttl: float | None = None) -> None:
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value, ttl)
+            except sqlite3.Error:
+                logger.exception(f"写入{self.name}磁盘缓存失败")
+
+    async def delete(self, key: str) -> None:
+        self.memory.pop(key)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.delete, key)
+            except sqlite3.Error:
+                logger.exception(f"删除{self.name}磁盘缓存失败")
@@ -5,7 +5,7 @@ from nonebot.compat import field_validator
 from pydantic import BaseModel, Field
 
 
-class LLMConfig(BaseModel):
+class LLMEndpointConfig(BaseModel):
     endpoint: str
     token: str
     name: str = Field(alias="model")
@@ -30,6 +30,10 @@ class LLMConfig(BaseModel):
         return v
 
 
+class LLMConfig(LLMEndpointConfig):
+    backups: list[LLMEndpointConfig] = []  # 备用端点, 按延迟和错误率选择, 主端点不可用时自动切换
+
+
 class TextLLMConfig(LLMConfig):
     is_mllm: bool = False
 
@@ -38,13 +42,151 @@ class BrowserConfig(BaseModel):
     proxy: str | None = None
     type: Literal["chromium", "firefox", "webkit"] = "chromium"
     install_on_startup: bool = True
+    prewarm: bool = False  # 启动时启动浏览器并预先创建页面
     use_htmlrender: bool = False
+    pool_size: int = 2  # 同时打开的页面数, 超出的请求排队等待
+    page_max_uses: int = 50  # 页面使用多少次后重新创建
+    page_max_heap: int = 256  # 页面 JS 堆超过多少 MB 后重新创建, 仅 chromium 有效
+    navigation: Literal["text", "full"] = "text"  # text: 拦截无关资源, DOM 加载且文本稳定后立即提取; full: 等待页面完全加载
+    blocked_resources: list[str] = ["image", "media", "font", "stylesheet"]  # text 模式下拦截的资源类型
+    network_idle_timeout: int = 1500  # text 模式下等待网络空闲的时间(毫秒)
+    text_stable_timeout: int = 5000  # text 模式下等待文本稳定的最长时间(毫秒)
+
+
+class WorkerConfig(BaseModel):
+    type: Literal["thread", "process"] = "thread"
+    max_workers: int = 2  # 同时执行的任务数
+    queue_size: int = 8  # 排队任务上限, 超出时等待
+
+
+class WebConfig(BaseModel):
+    fast_path: bool = True  # 先直接请求 HTML 提取正文, 内容过少时才使用浏览器
+    min_text_length: int = 200  # 正文少于该字数时视为需要 JavaScript 渲染
+    max_html_size: int = 5 * 1024 * 1024  # 直接请求时最多读取的 HTML 大小, 5MB
+    static_domains: list[str] = []  # 总是使用直接请求结果的域名(含子域名)
+    browser_domains: list[str] = []  # 总是使用浏览器的域名(含子域名)
 
 
 class PdfConfig(BaseModel):
     max_size: int = 10 * 1024 * 1024  # 10MB
     max_pages: int = 50  # 最大处理页数
     max_chars: int = 300000  # 最大字符数
+    mode: Literal["raw", "smart"] = "smart"  # smart: 去除页眉页脚, 按目录章节分配 token 预算; raw: 按字符数截取开头
+    max_tokens: int = 20000  # smart 模式下发送给模型的最大 token 数
+    spill_threshold: int = 32 * 1024 * 1024  # 超过该大小时写入临时文件而不是保存在内存中, 32MB
+    worker: WorkerConfig = WorkerConfig()
+
+
+class CacheConfig(BaseModel):
+    enabled: bool = True
+    ttl: int = 24 * 60 * 60  # 缓存有效期(秒)
+    max_entries: int = 512  # 内存缓存条目上限
+    disk: bool = False  # 额外使用插件数据目录下的 SQLite 缓存
+    disk_max_entries: int = 10000  # 磁盘缓存条目上限
+    log_stats: bool = True  # 命中缓存时记录命中统计
+
+
+class ImageCacheConfig(CacheConfig):
+    hash: Literal["sha256", "dhash"] = "sha256"  # dhash 为感知哈希, 重新压缩过的同一张图也能命中
+
+
+class ImageEncodeConfig(BaseModel):
+    max_pixels: int = 2048 * 2048  # 发送给模型的最大像素数
+    max_bytes: int = 2 * 1024 * 1024  # 发送给模型的最大体积, 2MB
+    quality: int = 85  # JPEG 初始质量
+    min_quality: int = 55  # 超出体积时逐步降低到的最低质量, 仍超出则继续缩小分辨率
+    passthrough: bool = True  # 满足限制的 JPEG/PNG/WebP 不重新编码
+
+
+class ImageConfig(BaseModel):
+    max_count: int = 2  # 单次请求最多处理的图片数
+    concurrency: int = 2  # 单次请求内同时识别的图片数
+    global_concurrency: int = 4  # 所有请求同时识别的图片数
+    cache: ImageCacheConfig = ImageCacheConfig()
+    encode: ImageEncodeConfig = ImageEncodeConfig()
+    worker: WorkerConfig = WorkerConfig()
+
+
+class AnswerCacheConfig(CacheConfig):
+    ttl: int = 30 * 60
+    max_entries: int = 256
+
+
+class UrlCacheConfig(CacheConfig):
+    ttl: int = 60 * 60  # 未在 ttl_by_type 中指定的内容的有效期(秒)
+    ttl_by_type: dict[str, int] = {"web_page": 60 * 60, "pdf": 7 * 24 * 60 * 60, "image": 24 * 60 * 60}
+    stale_ttl: int = 7 * 24 * 60 * 60  # 带 ETag/Last-Modified 的内容过期后保留多久用于重新验证
+    max_entries: int = 128
+
+
+class UrlConfig(BaseModel):
+    timeout: float = 60.0  # 获取链接内容的超时时间(秒)
+    max_text_size: int = 1024 * 1024  # 纯文本/JSON 链接最多读取的字节数, 1MB
+    max_image_size: int = 20 * 1024 * 1024  # 图片链接的最大体积, 20MB
+    cache: UrlCacheConfig = UrlCacheConfig()
+
+
+class HttpConfig(BaseModel):
+    http2: bool = True
+    max_connections: int = 20  # 每个端点的最大连接数
+    max_keepalive_connections: int = 10  # 每个端点保持的空闲连接数
+    keepalive_expiry: float = 30.0  # 空闲连接保持时间(秒)
+
+
+class PromptConfig(BaseModel):
+    max_tokens: int = 32000  # 用户提示的最大 token 数
+    tokenizer: Literal["heuristic", "tiktoken"] = "heuristic"  # heuristic: 按字符估算; tiktoken: 需要额外安装 tiktoken
+    encoding: str = "o200k_base"  # tiktoken 使用的编码
+    shares: dict[str, float] = {"interest": 0.2, "text": 0.1, "image": 0.2, "url": 0.5}  # 各部分的预算占比, 用不完的部分让给其余部分
+
+
+class LeakConfig(BaseModel):
+    ngram: int = 10  # 与系统提示比较的字符片段长度
+    min_match: int = 24  # 重合字符少于该值时直接通过
+    pass_below: float = 0.05  # 重合比例低于该值时直接通过, 不调用审查模型
+    block_above: float = 0.3  # 重合比例不低于该值时直接替换回复, 不调用审查模型
+
+
+class SchedulerConfig(BaseModel):
+    max_concurrency: int = 4  # 同时处理的请求数
+    group_concurrency: int = 2  # 每个群同时处理的请求数
+    user_concurrency: int = 1  # 每个用户同时处理的请求数
+    queue_size: int = 32  # 排队请求上限, 超出时直接拒绝
+    group_rate: float = 10  # 每个群每分钟的请求数, 0 为不限制
+    group_burst: int = 5  # 每个群短时间内最多连续发起的请求数
+    user_rate: float = 3  # 每个用户每分钟的请求数, 0 为不限制
+    user_burst: int = 2  # 每个用户短时间内最多连续发起的请求数
+    notify_queued: bool = True  # 需要排队时回复排队位置
+
+
+class StreamConfig(BaseModel):
+    mode: Literal["off", "chunk", "edit"] = "off"  # chunk: 按句子分段发送; edit: 不断编辑同一条消息, 适配器不支持时改为分段发送
+    min_length: int = 80  # 每段最少字数
+
+
+class RouterConfig(BaseModel):
+    ewma_alpha: float = 0.3  # 端点延迟和错误率统计的平滑系数, 越大越看重最近的请求
+    failure_threshold: int = 3  # 连续失败多少次后暂停使用该端点
+    cooldown: float = 30.0  # 暂停使用端点的时间(秒), 之后会再次尝试
+    hedge: bool = False  # 首字延迟过长时同时向下一个端点发起请求, 采用先返回的结果
+    hedge_percentile: float = 0.9  # 首字延迟超过该端点历史延迟的这个分位数时发起对冲请求
+    hedge_min_delay: float = 3.0  # 发起对冲请求前至少等待的时间(秒)
+
+
+class RetryConfig(BaseModel):
+    connect_timeout: float = 10.0  # 建立连接的超时时间(秒)
+    first_byte_timeout: float = 60.0  # 等待响应头和第一行流式数据的超时时间(秒)
+    idle_timeout: float = 30.0  # 流式响应两行数据之间的最长间隔(秒), 超出视为卡住并中止
+    total_timeout: float = 120.0  # 单次调用(含重试)的总时长(秒)
+    max_retries: int = 2  # 限流、超时、5xx 等可重试错误的重试次数
+    backoff_base: float = 0.5  # 指数退避的初始等待时间(秒)
+    backoff_max: float = 8.0  # 指数退避的最长等待时间(秒)
+
+
+class MetricsConfig(BaseModel):
+    enabled: bool = False  # 在驱动器的 HTTP 服务上提供 Prometheus 格式的指标, 需要 fastapi 等反向驱动器
+    path: str = "/zssm/metrics"
+    trace_logs: bool = True  # 本插件的日志带上每个请求的追踪 ID
 
 
 class PluginConfig(BaseModel):
@@ -52,7 +194,19 @@ class PluginConfig(BaseModel):
     vl: LLMConfig
     check: LLMConfig | None = None
     browser: BrowserConfig = BrowserConfig()
+    web: WebConfig = WebConfig()
     pdf: PdfConfig = PdfConfig()
+    image: ImageConfig = ImageConfig()
+    url: UrlConfig = UrlConfig()
+    http: HttpConfig = HttpConfig()
+    prompt: PromptConfig = PromptConfig()
+    leak: LeakConfig = LeakConfig()
+    answer: AnswerCacheConfig = AnswerCacheConfig()  # 相同问题的回答缓存
+    scheduler: SchedulerConfig = SchedulerConfig()
+    stream: StreamConfig = StreamConfig()  # 边生成边发送回答
+    router: RouterConfig = RouterConfig()  # 多端点选择
+    retry: RetryConfig = RetryConfig()  # ai 请求的超时和重试
+    metrics: MetricsConfig = MetricsConfig()
 
 
 class Config(BaseModel):
@@ -142,11 +142,11 @@ SYSTEM_PROMPT_IMAGE2_MLLM = """\
 SYSTEM_PROMPT_PART5 = """\
 3. 输出格式：
   - 使用 json 来结构化输出结果，不包含任何 markdown 语法标识
-  - 必须包含三个字段：output[str], keyword[list[str]], block[bool]
-  - 示例输出：{"output": "说明文本", "keyword": ["关键词1", "关键词2"], "block": false}
-  - output：解释内容，200-500字，避免使用特殊字符和转义序列
-  - keyword：1-5个核心关键词列表，按重要性排序，若无法提取则使用空列表[]
+  - 必须按顺序包含三个字段：block[bool], keyword[list[str]], output[str]
+  - 示例输出：{"block": false, "keyword": ["关键词1", "关键词2"], "output": "说明文本"}
   - block：布尔值，仅当内容违规或完全无可解释内容时设为true，其他情况均为false
+  - keyword：1-5个核心关键词列表，按重要性排序，若无法提取则使用空列表[]
+  - output：解释内容，200-500字，避免使用特殊字符和转义序列
   - 确保输出的json格式合法，特别注意字符串需正确使用双引号并处理内部引号
   - 即使在处理复杂内容时也应保持此输出格式不变
   - keyword选择策略：
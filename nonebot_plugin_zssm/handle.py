@@ -1,23 +1,29 @@
+import asyncio
 import contextlib
 import random
 import re
+from collections.abc import Awaitable, Coroutine
 
-import httpx
 from arclet.alconna import AllParam
-from nonebot import logger
-from nonebot.exception import ActionFailed
+from nonebot.exception import ActionFailed, MatcherException
 from nonebot.internal.adapter import Event
-from nonebot_plugin_alconna import Alconna, Args, Match, on_alconna
+from nonebot_plugin_alconna import Alconna, Args, Match, MsgTarget, on_alconna
 from nonebot_plugin_alconna.builtins.extensions.reply import ReplyRecordExtension
 from nonebot_plugin_alconna.builtins.uniseg.market_face import MarketFace
-from nonebot_plugin_alconna.uniseg import Image, MsgId, Reference, UniMessage, message_reaction
+from nonebot_plugin_alconna.uniseg import Image, MsgId, Receipt, Reference, Reply, UniMessage, message_reaction
 
+from .answer import answer_key, get_or_generate
 from .config import plugin_config
 from .constant import construct_system_prompt
+from .log import logger
+from .metrics import new_trace, requests_total, span
 from .processors.ai import generate_ai_response
-from .processors.image import process_image
+from .processors.image import describe_image, fetch_image, image_digest, image_pool, process_image
 from .processors.pdf import process_pdf
-from .processors.web import process_web_page
+from .processors.url import UrlResponse, cache_content, get_cached_content, open_url
+from .processors.web import extract_static_page, needs_browser, process_web_page
+from .prompt import PromptSection, fit_sections
+from .scheduler import SchedulerRejected, scheduler
 
 PATTERN_URL = re.compile(r"\b(?:https?):\/\/[^\s\/?#]+[^\s]*\b")
 PATTERN_PDF = re.compile(r"\b(?:https?):\/\/[^\s\/?#]+[^\s]*\.pdf\b")
@@ -38,9 +44,9 @@ async def display_unimsg(msg: UniMessage):
     return display
 
 
-async def extract_reply_content(event: Event, msg_id: MsgId, ext: ReplyRecordExtension) -> tuple[str, list[Image]]:
+async def extract_reply_content(event: Event, msg_id: MsgId, ext: ReplyRecordExtension) -> tuple[PromptSection | None, list[Image]]:
     if (reply := ext.get_reply(msg_id)) is None:
-        return "", []
+        return None, []
 
     if not (raw := reply.msg):
         await UniMessage.text("上一条消息内容为空").finish(reply_to=True)
@@ -50,54 +56,130 @@ async def extract_reply_content(event: Event, msg_id: MsgId, ext: ReplyRecordExt
 
     msg = UniMessage.of(message=raw)
     display = await display_unimsg(msg)
-    return f"<type: interest>\n{display}\n</type: interest>", msg[Image]
+    return PromptSection("interest", "<type: interest>\n", display, "\n</type: interest>"), msg[Image]
 
 
-async def extract_param_content(content: Match[UniMessage]) -> tuple[str, list[Image]]:
+async def extract_param_content(content: Match[UniMessage]) -> tuple[PromptSection | None, list[Image]]:
     if not content.available:
-        return "", []
+        return None, []
 
     display = await display_unimsg(content.result)
-    return f"<type: text>\n{display}\n</type: text>", content.result[Image]
+    return PromptSection("text", "<type: text>\n", display, "\n</type: text>"), content.result[Image]
 
 
-async def process_images(image_list: list[Image]):
-    for image in image_list:
-        image_content = await process_image(image)
-        if not image_content:
-            await UniMessage.text("图片识别失败").finish(reply_to=True)
-        yield f"\n<type: image, id: {hash(image.url)}>\n{image_content}\n</type: image, id: {hash(image.url)}>"
+async def process_images(image_list: list[Image]) -> list[PromptSection]:
+    semaphore = asyncio.Semaphore(plugin_config.image.concurrency)
+
+    async def describe(image: Image) -> str | None:
+        async with semaphore:
+            return await process_image(image)
+
+    # 并发识别, 结果保持原有顺序
+    image_contents = await asyncio.gather(*(describe(image) for image in image_list))
+    if not all(image_contents):
+        await UniMessage.text("图片识别失败").finish(reply_to=True)
+
+    return [
+        PromptSection(
+            "image",
+            f"\n<type: image, id: {hash(image.url)}>\n",
+            image_content,
+            f"\n</type: image, id: {hash(image.url)}>",
+        )
+        for image, image_content in zip(image_list, image_contents, strict=True)
+        if image_content is not None
+    ]
+
 
+async def _single(section: Awaitable[PromptSection]) -> list[PromptSection]:
+    return [await section]
 
-async def url_is_pdf(url: str) -> bool:
+
+async def run_stages(stages: list[Coroutine[None, None, list[PromptSection]]]) -> list[list[PromptSection]]:
+    """并发执行各处理阶段, 结果按传入顺序返回
+
+    第一个阶段完成时更新反应; 任一阶段失败(包括 finish)时取消其余阶段
+    """
+    reacted = False
+
+    async def run(stage: Coroutine[None, None, list[PromptSection]]) -> list[PromptSection]:
+        nonlocal reacted
+        result = await stage
+        if not reacted:
+            reacted = True
+            with contextlib.suppress(ActionFailed):
+                await message_reaction("314")
+        return result
+
+    tasks = [asyncio.ensure_future(run(stage)) for stage in stages]
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.head(url, follow_redirects=True)
-            content_type: str = resp.headers.get("Content-Type", "")
-            return "application/pdf" in content_type.lower()
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_images(image_urls: list[str]) -> list[bytes]:
+    try:
+        return await asyncio.gather(*(fetch_image(url) for url in image_urls))
     except Exception:
-        return bool(PATTERN_PDF.match(url))
+        await UniMessage.text("图片获取失败").finish(reply_to=True)
+
 
+def format_url_content(kind: str, url: str, content: str) -> PromptSection:
+    return PromptSection("url", f"\n<type: {kind}, url: {url}>\n", content, f"\n</type: {kind}>")
 
-async def process_url(url: str) -> str:
+
+async def read_url_response(source: UrlResponse) -> tuple[str, str] | None:
+    """直接读取不需要浏览器的链接内容, 网页等其他类型返回 None"""
+    match source.kind:
+        case "pdf":
+            await UniMessage.text("正在尝试处理PDF文件").send(reply_to=True)
+            if pdf_content := await process_pdf(source.url, source):
+                return "pdf", pdf_content
+            await UniMessage.text("无法处理PDF文件，请检查文件是否有效且大小合适").finish(reply_to=True)
+        case "image":
+            await UniMessage.text("正在尝试识别图片").send(reply_to=True)
+            if (data := await source.read(plugin_config.url.max_image_size)) and (image_content := await describe_image(data)):
+                return "image", image_content
+            await UniMessage.text("图片识别失败").finish(reply_to=True)
+        case "text":
+            if (text := await source.read_text(plugin_config.url.max_text_size)) is not None:
+                return "text", text
+            return None
+        case "html" if not needs_browser(source.url):
+            if page_content := await extract_static_page(source):
+                return "web_page", page_content
+            return None
+        case _:
+            return None
+
+
+async def process_url(url: str) -> PromptSection:
     logger.info(f"处理URL: {url}")
 
-    # 尝试检测链接内容类型
-    if await url_is_pdf(url):
-        # 处理PDF链接
-        await UniMessage.text("正在尝试处理PDF文件").send(reply_to=True)
-        if pdf_content := await process_pdf(url):
-            return f"\n<type: pdf, url: {url}>\n{pdf_content}\n</type: pdf>"
+    if (cached := await get_cached_content(url)) is not None:
+        return format_url_content(cached.kind, url, cached.content)
 
-        await UniMessage.text("无法处理PDF文件，请检查文件是否有效且大小合适").finish(reply_to=True)
+    # 只发起一次请求, 根据响应头和文件头判断内容类型
+    async with open_url(url) as source:
+        headers = source.headers if source is not None else None
+        if source is not None:
+            logger.info(f"链接内容类型: {source.kind}, {source.headers.get('Content-Type')}")
+            if (result := await read_url_response(source)) is not None:
+                kind, content = result
+                await cache_content(url, kind, content, headers)
+                return format_url_content(kind, url, content)
 
     # 处理普通网页链接
     await UniMessage.text("正在尝试打开链接").send(reply_to=True)
 
     if page_content := await process_web_page(url):
-        return f"\n<type: web_page, url: {url}>\n{page_content}\n</type: web_page>"
-    if pdf_content := await process_pdf(url):
-        return f"\n<type: pdf, url: {url}>\n{pdf_content}\n</type: pdf>"
+        await cache_content(url, "web_page", page_content, headers)
+        return format_url_content("web_page", url, page_content)
+    # 无法直接请求的链接仍可能是PDF
+    if source is None and PATTERN_PDF.match(url) and (pdf_content := await process_pdf(url)):
+        return format_url_content("pdf", url, pdf_content)
 
     await UniMessage.text("无法获取页面内容").finish(reply_to=True)
 
@@ -108,36 +190,96 @@ async def construct_user_prompt(
     ext: ReplyRecordExtension,
     content: Match[UniMessage],
 ) -> tuple[str, list[str]]:
-    reply_text, reply_images = await extract_reply_content(event, msg_id, ext)
-    param_text, param_images = await extract_param_content(content)
+    with span("reply_extract"):
+        reply_section, reply_images = await extract_reply_content(event, msg_id, ext)
+        param_section, param_images = await extract_param_content(content)
 
-    raw_input = prompt = reply_text + param_text
+    sections = [section for section in (reply_section, param_section) if section is not None]
+    raw_input = "".join(section.render() for section in sections)
     image_list = reply_images + param_images
-    if not prompt and not image_list:
+    if not raw_input and not image_list:
         await UniMessage.text("请回复或输入内容").finish(reply_to=True)
 
-    # 处理图片, 最多2张
-    if len(image_list) > 2:
-        await UniMessage.text("图片数量超过限制, 最多 2 张").finish(reply_to=True)
+    # 处理图片, 数量受配置限制
+    if len(image_list) > (max_count := plugin_config.image.max_count):
+        await UniMessage.text(f"图片数量超过限制, 最多 {max_count} 张").finish(reply_to=True)
 
     with contextlib.suppress(ActionFailed):
         await message_reaction("424")
 
-    if not plugin_config.text.is_mllm:
-        async for image_content in process_images(image_list):
-            prompt += image_content
-
-    # 处理URL和PDF
+    # 图片识别和URL/PDF处理互不依赖, 并发执行
+    stages: list[Coroutine[None, None, list[PromptSection]]] = []
+    if image_list and not plugin_config.text.is_mllm:
+        stages.append(process_images(image_list))
     if msg_urls := PATTERN_URL.findall(raw_input):
         # 尝试处理第一个链接
-        prompt += await process_url(msg_urls[0])
+        stages.append(_single(process_url(msg_urls[0])))
+
+    # 按固定顺序拼接各部分: 图片在前, 链接在后
+    for stage_sections in await run_stages(stages):
+        sections.extend(stage_sections)
 
-    # 如果处理了URL/PDF或图片, 更新反应
-    if msg_urls or image_list:
+    # 只有多模态模型处理的图片没有经过处理阶段, 单独更新反应
+    if not stages and image_list:
         with contextlib.suppress(ActionFailed):
             await message_reaction("314")
 
-    return prompt, [image.url for image in image_list if image.url is not None]
+    # 各部分按配置的预算占比截断, 避免超出模型上下文
+    return fit_sections(sections), [image.url for image in image_list if image.url is not None]
+
+
+class StreamingReply:
+    """把逐步生成的回答发送到聊天中
+
+    edit 模式下不断编辑第一条消息, 适配器不支持编辑时改为分段发送
+    """
+
+    def __init__(self, *, reply_to: Reply | bool, edit: bool) -> None:
+        self.reply_to = reply_to
+        self.edit = edit
+        self.sent: list[str] = []
+        self._receipt: Receipt | None = None
+
+    async def _edit(self, text: str) -> bool:
+        if self._receipt is None or not self._receipt.msg_ids:
+            return False
+        receipt = self._receipt
+        try:
+            await receipt.exporter.edit(UniMessage.text(text), receipt.msg_ids[0], receipt.bot, receipt.context)
+        except NotImplementedError:
+            logger.info("当前适配器不支持编辑消息, 改为分段发送")
+        except Exception:
+            logger.exception("编辑消息失败, 改为分段发送")
+        else:
+            return True
+        self.edit = False
+        return False
+
+    async def send(self, chunk: str) -> None:
+        self.sent.append(chunk)
+        if self.edit and await self._edit("".join(self.sent).strip()):
+            return
+
+        receipt = await UniMessage.text(chunk.strip()).send(reply_to=self.reply_to if self._receipt is None else False)
+        self._receipt = self._receipt or receipt
+
+    async def finish(self, response: str) -> None:
+        """发送完整回答中尚未发送的部分"""
+        streamed = "".join(self.sent)
+        if (index := response.find(streamed)) < 0:
+            # 完整回答被替换(如未通过审查), 编辑模式下覆盖已发送的内容, 否则只能另外发送
+            if self.edit and await self._edit(response):
+                await zssm.finish()
+            await UniMessage.text(response).finish(reply_to=self.reply_to)
+
+        if self.edit and await self._edit(response):
+            await zssm.finish()
+
+        rest = response[index + len(streamed) :].strip()
+        keywords = response[:index].strip()
+        if message := "\n\n".join(part for part in (rest, keywords) if part):
+            await UniMessage.text(message).finish()
+        await zssm.finish()
 
 
 zssm = on_alconna(
@@ -153,8 +295,7 @@ async def check_config() -> None:
         await UniMessage.text("未配置 Api Key, 暂时无法使用").finish(reply_to=True)
 
 
-@zssm.handle()
-async def handle(
+async def respond(
     event: Event,
     msg_id: MsgId,
     ext: ReplyRecordExtension,
@@ -163,12 +304,60 @@ async def handle(
     random_number = random.randint(10000000, 99999999)  # noqa: S311
     system_prompt = construct_system_prompt(random_number, is_mllm=plugin_config.text.is_mllm)
     user_prompt, image_urls = await construct_user_prompt(event, msg_id, ext, content)
+
+    # 多模态模型直接接收图片, 先下载图片用于计算回答的缓存键
+    images = await fetch_images(image_urls) if plugin_config.text.is_mllm else []
+    image_digests = await asyncio.gather(*(image_pool.run(image_digest, data) for data in images))
+    key = answer_key(system_prompt.replace(str(random_number), ""), user_prompt, image_digests)
+
     user_prompt = f"<random number: {random_number}>\n{user_prompt}\n</random number: {random_number}>"
     logger.info("最终用户提示: \n" + user_prompt.replace("\n", "\\n"))
 
-    if (response := await generate_ai_response(system_prompt, user_prompt, image_urls)) is None:
+    reply_to = ext.get_reply(msg_id) or True
+    stream_mode = plugin_config.stream.mode
+    reply = StreamingReply(reply_to=reply_to, edit=stream_mode == "edit") if stream_mode != "off" else None
+    on_output = reply.send if reply is not None else None
+
+    response = await get_or_generate(key, lambda: generate_ai_response(system_prompt, user_prompt, images, random_number, on_output))
+    if response is None:
+        requests_total.inc("failed")
         await UniMessage.text("AI 回复解析失败, 请重试").finish(reply_to=True)
 
-    with contextlib.suppress(ActionFailed):
-        await message_reaction("144")
-    await UniMessage.text(response).finish(reply_to=ext.get_reply(msg_id) or True)
+    requests_total.inc("ok")
+    with span("send"):
+        with contextlib.suppress(ActionFailed):
+            await message_reaction("144")
+        # 等待其他相同请求或命中缓存时没有分段发送过, 按原样发送完整回答
+        if reply is not None and reply.sent:
+            await reply.finish(response)
+        await UniMessage.text(response).finish(reply_to=reply_to)
+
+
+async def notify_queued(ahead: int) -> None:
+    await UniMessage.text("请求排队中, 请稍候" + (f", 前面约有 {ahead} 个请求" if ahead else "")).send(reply_to=True)
+
+
+@zssm.handle()
+async def handle(
+    event: Event,
+    msg_id: MsgId,
+    ext: ReplyRecordExtension,
+    content: Match[UniMessage],
+    target: MsgTarget,
+) -> None:
+    new_trace()
+    # 按群排队, 私聊各自算作一个群
+    group = f"private:{target.id}" if target.private else f"{target.parent_id}:{target.id}"
+    on_queued = notify_queued if plugin_config.scheduler.notify_queued else None
+    try:
+        with span("request_total"):
+            async with scheduler.slot(group, event.get_user_id(), on_queued):
+                await respond(event, msg_id, ext, content)
+    except SchedulerRejected as e:
+        requests_total.inc("rejected")
+        await UniMessage.text(e.message).finish(reply_to=True)
+    except MatcherException:
+        raise
+    except Exception:
+        requests_total.inc("error")
+        raise
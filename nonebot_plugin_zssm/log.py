@@ -0,0 +1,21 @@
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+from nonebot import logger as nonebot_logger
+
+from .config import plugin_config
+
+if TYPE_CHECKING:
+    from loguru import Record
+
+trace_id: ContextVar[str | None] = ContextVar("zssm_trace_id", default=None)
+
+
+def _add_trace_id(record: "Record") -> None:
+    """给请求上下文中输出的日志加上追踪 ID"""
+    if (value := trace_id.get()) is not None:
+        record["message"] = f"[{value}] {record['message']}"
+
+
+# 只修改本插件使用的 logger, 不影响全局配置和其他插件的日志
+logger = nonebot_logger.patch(_add_trace_id) if plugin_config.metrics.trace_logs else nonebot_logger
@@ -0,0 +1,143 @@
+import bisect
+import contextlib
+import time
+import uuid
+from collections.abc import Callable, Iterator
+
+from nonebot.drivers import URL, Driver, HTTPServerSetup, Request, Response, ReverseDriver
+
+from .cache import caches
+from .config import plugin_config
+from .log import logger, trace_id
+
+config = plugin_config.metrics
+
+# 覆盖从几毫秒的缓存命中到几分钟的推理模型
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = tuple[str, ...]
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items())
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # 每组标签: 各桶计数(最后一个为 +Inf), 总和
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        if (entry := self._values.get(labels)) is None:
+            entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts, strict=True):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+stage_seconds = Histogram("zssm_stage_seconds", "各处理阶段的耗时(秒)", ("stage",))
+requests_total = Counter("zssm_requests_total", "zssm 请求数", ("result",))
+tokens_total = Counter("zssm_tokens_total", "token 数, prompt 为估算值, completion 优先使用服务端返回的用量, 否则为估算值", ("kind",))
+payload_bytes_total = Counter("zssm_payload_bytes_total", "下载的内容大小(字节)", ("kind",))
+
+_metrics: list[Counter | Histogram] = [stage_seconds, requests_total, tokens_total, payload_bytes_total]
+_collectors: list[Callable[[], list[str]]] = []
+
+
+def register_collector(collector: Callable[[], list[str]]) -> None:
+    """注册在导出时才计算的指标, 如缓存命中数"""
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+def new_trace() -> str:
+    """为当前请求生成追踪 ID, 之后同一上下文中的日志都会带上它"""
+    value = uuid.uuid4().hex[:12]
+    trace_id.set(value)
+    return value
+
+
+@contextlib.contextmanager
+def span(stage: str) -> Iterator[None]:
+    """记录一个处理阶段的耗时, 同步和异步代码中都可以使用"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage)
+        logger.debug(f"阶段 {stage} 耗时 {elapsed * 1000:.1f}ms")
+
+
+def _collect_caches() -> list[str]:
+    name = "zssm_cache_requests_total"
+    lines = [f"# HELP {name} 缓存查询数", f"# TYPE {name} counter"]
+    for cache in caches:
+        stats = cache.stats
+        lines.append(f'{name}{{cache="{cache.name}",result="memory_hit"}} {stats.hits - stats.disk_hits}')
+        lines.append(f'{name}{{cache="{cache.name}",result="disk_hit"}} {stats.disk_hits}')
+        lines.append(f'{name}{{cache="{cache.name}",result="miss"}} {stats.misses}')
+    return lines
+
+
+register_collector(_collect_caches)
+
+
+async def _handle_metrics(request: Request) -> Response:  # noqa: ARG001
+    return Response(200, headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}, content=render_metrics())
+
+
+def setup_metrics(driver: Driver) -> None:
+    if not config.enabled:
+        return
+    if not isinstance(driver, ReverseDriver):
+        logger.warning("当前驱动器不支持 HTTP 服务, 无法提供指标")
+        return
+
+    driver.setup_http_server(HTTPServerSetup(URL(config.path), "GET", "zssm_metrics", _handle_metrics))
+    logger.info(f"指标地址: {config.path}")
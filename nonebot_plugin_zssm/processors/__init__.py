@@ -1,6 +1,6 @@
 from .ai import generate_ai_response
-from .image import process_image
+from .image import describe_image, process_image
 from .pdf import process_pdf
 from .web import process_web_page
 
-__all__ = ["generate_ai_response", "process_image", "process_pdf", "process_web_page"]
+__all__ = ["describe_image", "generate_ai_response", "process_image", "process_pdf", "process_web_page"]
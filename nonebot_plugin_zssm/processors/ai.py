@@ -1,18 +1,23 @@
 import json
 import re
 import time
+from collections.abc import Awaitable, Callable
 
-from nonebot import logger
 from nonebot.compat import type_validate_json
 from pydantic import BaseModel
 
-from ..api import AsyncChatClient
 from ..config import plugin_config
 from ..constant import AUDIT_SYSTEM_PROMPT, AUDIT_USER_PROMPT
-from .image import url_to_base64
+from ..log import logger
+from ..metrics import span, stage_seconds, tokens_total
+from ..router import RoutedChatClient
+from .image import encode_image, image_pool
+from .leak import check_leakage_locally
+from .stream import OutputExtractor, SentenceChunker
 
 config = plugin_config.text
 config_check = plugin_config.check
+stream_config = plugin_config.stream
 
 
 class LLMResponse(BaseModel):
@@ -52,10 +57,19 @@ def truncate_chunk(chunk: str) -> str:
     return f"{chunk[:20]}...{len(chunk) - 40}...{chunk[-20:]}" if len(chunk) > 60 else chunk
 
 
-async def check_prompt_leakage(response: str, system_prompt: str) -> str:
+async def check_prompt_leakage(response: str, system_prompt: str, random_number: int | None = None) -> str:
+    # 先在本地比较回复与 system prompt 的重合程度, 只有难以判断时才调用审查模型
+    verdict, score = check_leakage_locally(response, system_prompt, random_number)
+    if verdict == "pass":
+        logger.debug(f"本地泄露检查通过, 重合比例: {score:.1%}")
+        return response
+    if verdict == "block":
+        logger.warning(f"本地检查到 system prompt 泄露, 重合比例: {score:.1%}, 已替换响应")
+        return "（抱歉，我现在还不会这个）"
+
     if config_check is None:
         # 如果没有配置审查API Token，则跳过审查
-        logger.warning("未配置审查API Token，跳过system prompt泄露检查")
+        logger.warning(f"未配置审查API Token，跳过system prompt泄露检查, 本地重合比例: {score:.1%}")
         return response
 
     try:
@@ -64,12 +78,13 @@ async def check_prompt_leakage(response: str, system_prompt: str) -> str:
             response=response,
         )
 
-        logger.info(f"开始审查AI响应: {config_check.name}")
-        async with AsyncChatClient(config_check) as client:
-            audit_response = await client.create(
-                {"role": "system", "content": AUDIT_SYSTEM_PROMPT},
-                {"role": "user", "content": prompt},
-            )
+        logger.info(f"开始审查AI响应: {config_check.name}, 本地重合比例: {score:.1%}")
+        async with RoutedChatClient(config_check) as client:
+            with span("leak_audit"):
+                audit_response = await client.create(
+                    {"role": "system", "content": AUDIT_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                )
 
             if not audit_response or "choices" not in audit_response:
                 logger.error("审查AI返回内容为空或格式错误")
@@ -98,38 +113,90 @@ async def check_prompt_leakage(response: str, system_prompt: str) -> str:
 async def generate_ai_response(
     system_prompt: str,
     user_prompt: str,
-    image_urls: list[str] | None = None,
+    images: list[bytes] | None = None,
+    random_number: int | None = None,
+    on_output: Callable[[str], Awaitable[None]] | None = None,
 ) -> str | None:
+    """生成回答
+
+    Args:
+        on_output: 逐句接收已生成的 output 内容, 只会收到通过本地泄露检查的部分;
+            之后返回的完整回答中可能包含已发送过的内容.
+            配置了审查模型时不会调用, 完整回答需要先经过审查
+    """
     if not config.token:
         return None
 
     user_content: list[dict[str, object]] = [{"type": "text", "text": user_prompt}]
 
-    if config.is_mllm and image_urls is not None:
-        for url in image_urls:
-            try:
-                encoded_image = await url_to_base64(url)
-            except Exception:
-                logger.exception(f"图片处理失败: {url}")
-                return None
-            user_content.append({"type": "image_url", "image_url": {"url": encoded_image}})
+    if config.is_mllm and images is not None:
+        with span("image_encode"):
+            for data in images:
+                try:
+                    encoded_image = await image_pool.run(encode_image, data)
+                except Exception:
+                    logger.exception("图片处理失败")
+                    return None
+                user_content.append({"type": "image_url", "image_url": {"url": encoded_image}})
+
+    extractor = OutputExtractor()
+    chunker = SentenceChunker(stream_config.min_length)
+    # 审查模型只能检查完整回答, 提前发送会绕过审查
+    streaming = on_output is not None and config_check is None
+    leaked = False
+
+    async def emit(chunk: str | None) -> bool:
+        """发送一段回答, 返回是否继续发送后续内容"""
+        nonlocal leaked
+        if chunk is None or on_output is None:
+            return True
+
+        verdict, score = check_leakage_locally(chunk, system_prompt, random_number)
+        if verdict != "pass":
+            # 可疑的内容不再提前发送, 等完整回答经过审查后再发送
+            logger.warning(f"分段回答未通过本地泄露检查: {verdict}, 重合比例: {score:.1%}, 停止分段发送")
+            leaked = verdict == "block"
+            return False
+
+        try:
+            await on_output(chunk)
+        except Exception:
+            logger.exception("发送分段回答失败, 停止分段发送")
+            return False
+        return True
 
     try:
         last_time = time.time()
-        last_chunk = ""
+        started = time.perf_counter()
         i = 0
-        async with AsyncChatClient(config) as client:
-            async for chunk in client.stream_create(
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content},
-            ):
-                i += 1
-                last_chunk = chunk
-                if time.time() - last_time > 5:
-                    last_time = time.time()
-                    logger.info(f"AI响应进度: {i}, {truncate_chunk(last_chunk)}")
-
-        logger.info(f"AI响应完成: {i}\n{truncate_chunk(last_chunk)}")
+        with span("llm_total"):
+            async with RoutedChatClient(config) as client:
+                async for delta in client.stream_delta(
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_content},
+                ):
+                    i += 1
+                    if i == 1:
+                        stage_seconds.observe(time.perf_counter() - started, "llm_ttft")
+                    if time.time() - last_time > 5:
+                        last_time = time.time()
+                        logger.info(f"AI响应进度: {i}, {truncate_chunk(client.reasoning_content + client.content)}")
+
+                    if streaming and delta.content:
+                        output = extractor.feed(delta.content)
+                        if output and extractor.block is not False:
+                            # 没有在 output 之前确认 block 为 false, 等完整回答解析后再发送
+                            logger.info(f"回答的 block 字段为 {extractor.block}, 不分段发送")
+                            streaming = False
+                            continue
+                        streaming = await emit(chunker.feed(output))
+                        if streaming and extractor.done:
+                            # output 字段已经结束, 不必等待其余字段
+                            await emit(chunker.flush())
+                            streaming = False
+
+        tokens_total.inc("completion", amount=client.completion_tokens)
+        logger.info(f"AI响应完成: {i}\n{truncate_chunk(client.reasoning_content + client.content)}")
 
         if not (data := client.content):
             logger.error("AI返回内容为空")
@@ -142,7 +209,11 @@ async def generate_ai_response(
         if llm_resp.block:
             return "（抱歉, 我现在还不会这个）"
 
-        output = await check_prompt_leakage(llm_resp.output, system_prompt)
+        if leaked:
+            logger.warning("分段回答中检测到 system prompt 泄露，已替换响应")
+            return "（抱歉，我现在还不会这个）"
+
+        output = await check_prompt_leakage(llm_resp.output, system_prompt, random_number)
 
         return (
             f"关键词：{' | '.join(keywords) if isinstance(keywords, list) else keywords}\n\n" if (keywords := llm_resp.keyword) else ""
@@ -1,28 +1,49 @@
+import asyncio
 import base64
+import hashlib
 import ssl
 import time
 from io import BytesIO
 
 import httpx
-from nonebot import logger
 from nonebot_plugin_alconna.uniseg import Image
+from nonebot_plugin_localstore import get_plugin_data_file
 from PIL import Image as PILImage
+from PIL import ImageOps
 
-from ..api import AsyncChatClient
-from ..config import plugin_config
+from ..cache import TieredCache
+from ..config import ImageEncodeConfig, plugin_config
 from ..constant import IMAGE_PROMPT
+from ..log import logger
+from ..metrics import payload_bytes_total, span
+from ..router import RoutedChatClient
+from ..worker import WorkerPool
 
 config = plugin_config.vl
+cache_config = plugin_config.image.cache
+encode_config = plugin_config.image.encode
 
+PASSTHROUGH_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
 
-async def url_to_base64(url: str) -> str:
-    """将URL图片转换为base64编码
+_global_slots = asyncio.Semaphore(plugin_config.image.global_concurrency)
+image_pool = WorkerPool("图片处理", plugin_config.image.worker)
+description_cache = TieredCache(
+    "图片描述",
+    max_entries=cache_config.max_entries,
+    ttl=cache_config.ttl,
+    disk_path=get_plugin_data_file("image_cache.db") if cache_config.disk else None,
+    disk_max_entries=cache_config.disk_max_entries,
+)
+
+
+async def fetch_image(url: str) -> bytes:
+    """下载URL图片
 
     Args:
         url: 图片URL
 
     Returns:
-        str: base64编码的图片数据
+        bytes: 图片原始数据
     """
     ssl_context = ssl.create_default_context()
     ssl_context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1 | ssl.OP_NO_TLSv1_3
@@ -30,22 +51,114 @@ async def url_to_base64(url: str) -> str:
 
     async with httpx.AsyncClient(verify=ssl_context) as client:
         try:
-            response = (await client.get(url, timeout=30.0)).raise_for_status()
+            with span("image_download"):
+                response = (await client.get(url, timeout=30.0)).raise_for_status()
         except httpx.HTTPError as e:
             logger.opt(exception=e).error(f"获取图片失败: {url}, 错误: {e}")
             raise
 
-        image = PILImage.open(BytesIO(response.content))
-        # 把图片控制在5mb以内
-        if len(response.content) > 5 * 1024 * 1024:
-            image.thumbnail((4096, 4096))
-        if image.mode != "RGB":
-            image = image.convert("RGB")
+        payload_bytes_total.inc("image", amount=len(response.content))
+        return response.content
+
+
+def _to_rgb(image: PILImage.Image) -> PILImage.Image:
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        # 透明区域以白底合成, 直接转换 RGB 会变成黑色
+        rgba = image.convert("RGBA")
+        background = PILImage.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image if image.mode == "RGB" else image.convert("RGB")
 
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG", quality=80)
-        b64_content = base64.b64encode(buffered.getvalue()).decode()
-        return f"data:image/jpeg;base64,{b64_content}"
+
+def encode_image(data: bytes, options: ImageEncodeConfig | None = None) -> str:
+    """将图片数据转换为base64编码
+
+    同步的 CPU 密集操作, 请通过 `image_pool` 调用
+
+    已满足像素和体积限制的 JPEG/PNG/WebP 原样发送, 其余图片缩放到像素上限内,
+    再逐步降低 JPEG 质量和分辨率直到满足体积限制, 动图只取第一帧
+
+    Args:
+        data: 图片原始数据
+        options: 编码参数, 默认使用插件配置
+
+    Returns:
+        str: base64编码的图片数据
+    """
+    options = options or encode_config
+
+    with PILImage.open(BytesIO(data)) as image:
+        width, height = image.size
+        mime = PASSTHROUGH_MIME.get(image.format or "")
+        if (
+            options.passthrough
+            and mime is not None
+            and not getattr(image, "is_animated", False)
+            and len(data) <= options.max_bytes
+            and width * height <= options.max_pixels
+        ):
+            return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+        if image.format == "JPEG":
+            # JPEG 可以直接以接近目标的分辨率解码, 省去大部分解码开销; draft 按旋转前的宽高计算
+            scale = min(1.0, (options.max_pixels / (width * height)) ** 0.5)
+            image.draft("RGB", (max(1, int(width * scale)), max(1, int(height * scale))))
+
+        frame = _to_rgb(ImageOps.exif_transpose(image))
+
+    # EXIF 方向为 5-8 时旋转后宽高互换, 目标尺寸按旋转后的图像计算
+    scale = min(1.0, (options.max_pixels / (frame.width * frame.height)) ** 0.5)
+    target = (max(1, int(frame.width * scale)), max(1, int(frame.height * scale)))
+    if frame.size != target:
+        frame = frame.resize(target, PILImage.Resampling.LANCZOS, reducing_gap=3.0)
+
+    while True:
+        for quality in range(options.quality, options.min_quality - 1, -10):
+            buffered = BytesIO()
+            frame.save(buffered, format="JPEG", quality=quality, optimize=True)
+            if buffered.tell() <= options.max_bytes:
+                break
+        else:
+            if min(frame.size) > 64:
+                frame = frame.resize((max(1, frame.width * 3 // 4), max(1, frame.height * 3 // 4)), PILImage.Resampling.LANCZOS)
+                continue
+        break
+
+    return f"data:image/jpeg;base64,{base64.b64encode(buffered.getvalue()).decode()}"
+
+
+async def url_to_base64(url: str) -> str:
+    """将URL图片转换为base64编码
+
+    Args:
+        url: 图片URL
+
+    Returns:
+        str: base64编码的图片数据
+    """
+    return await image_pool.run(encode_image, await fetch_image(url))
+
+
+def dhash(data: bytes, size: int = 8) -> str:
+    """计算图片的差值感知哈希, 缩放/重新压缩后的同一张图通常得到相同的结果"""
+    with PILImage.open(BytesIO(data)) as image:
+        image.draft("L", (size * 4, size * 4))
+        pixels = image.convert("L").resize((size + 1, size), PILImage.Resampling.LANCZOS).tobytes()
+
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            offset = row * (size + 1) + col
+            bits = bits << 1 | (pixels[offset] > pixels[offset + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def image_digest(data: bytes) -> str:
+    """计算图片内容的缓存键"""
+    if cache_config.hash == "dhash":
+        return f"dhash:{dhash(data)}"
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
 
 
 def truncate_chunk(chunk: str) -> str:
@@ -65,28 +178,62 @@ async def process_image(image: Image) -> str | None:
         return None
 
     logger.info(f"处理图片: {image.url}")
+    try:
+        data = await fetch_image(image.url)
+    except Exception as e:
+        logger.opt(exception=e).error(f"图片处理失败: {e}")
+        return None
+
+    return await describe_image(data)
+
+
+async def describe_image(data: bytes) -> str | None:
+    """识别图片数据, 返回图片描述
+
+    Args:
+        data: 图片原始数据
+
+    Returns:
+        Optional[str]: 图片描述内容, 失败时返回None
+    """
+    if not config.token:
+        return None
+
+    async with _global_slots:
+        return await _describe_image(data)
+
+
+async def _describe_image(data: bytes) -> str | None:
     last_time = time.time()
-    last_chunk = ""
     i = 0
 
     try:
-        image_url = await url_to_base64(image.url)
+        cache_key = f"{await image_pool.run(image_digest, data)}:{config.name}"
+        if cache_config.enabled and (cached := await description_cache.get(cache_key)) is not None:
+            if cache_config.log_stats:
+                logger.info(f"图片描述命中缓存: {cache_key}, {description_cache.stats}")
+            return cached
+
+        with span("image_encode"):
+            image_url = await image_pool.run(encode_image, data)
         content = [
             {"type": "image_url", "image_url": {"url": image_url}},
             {"type": "text", "text": IMAGE_PROMPT},
         ]
 
-        async with AsyncChatClient(config) as client:
-            async for chunk in client.stream_create({"role": "user", "content": content}):
-                i += 1
-                last_chunk = chunk
-                if time.time() - last_time > 5:
-                    last_time = time.time()
-                    logger.info(f"图片处理进度: {i}, {truncate_chunk(last_chunk)}")
+        with span("vl_completion"):
+            async with RoutedChatClient(config) as client:
+                async for _ in client.stream_delta({"role": "user", "content": content}):
+                    i += 1
+                    if time.time() - last_time > 5:
+                        last_time = time.time()
+                        logger.info(f"图片处理进度: {i}, {truncate_chunk(client.reasoning_content + client.content)}")
 
     except Exception as e:
         logger.opt(exception=e).error(f"图片处理失败: {e}")
         return None
     else:
-        logger.info(f"图片处理完成: {i}, {last_chunk}")
+        logger.info(f"图片处理完成: {i}, {client.reasoning_content + client.content}")
+        if cache_config.enabled and client.content:
+            await description_cache.set(cache_key, client.content)
         return client.content
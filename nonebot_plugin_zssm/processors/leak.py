@@ -0,0 +1,61 @@
+import re
+from functools import lru_cache
+from typing import Literal
+
+from ..config import plugin_config
+
+config = plugin_config.leak
+
+PATTERN_NON_WORD = re.compile(r"[\W_]+")
+
+LeakVerdict = Literal["pass", "block", "audit"]
+
+
+def _normalize(text: str) -> str:
+    # 忽略大小写、空白和标点, 避免换个排版就绕过检测
+    return PATTERN_NON_WORD.sub("", text.lower())
+
+
+@lru_cache(maxsize=4)
+def _prompt_shingles(system_prompt: str, n: int) -> frozenset[str]:
+    text = _normalize(system_prompt)
+    return frozenset(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+def leakage_score(response: str, system_prompt: str) -> tuple[float, int]:
+    """计算回复中与系统提示重合的字符片段
+
+    Returns:
+        重合字符占回复的比例, 重合的字符数
+    """
+    n = config.ngram
+    text = _normalize(response)
+    if len(text) < n:
+        return 0.0, 0
+
+    shingles = _prompt_shingles(system_prompt, n)
+    covered = bytearray(len(text))
+    for i in range(len(text) - n + 1):
+        if text[i : i + n] in shingles:
+            covered[i : i + n] = b"\x01" * n
+    matched = sum(covered)
+    return matched / len(text), matched
+
+
+def check_leakage_locally(response: str, system_prompt: str, random_number: int | None = None) -> tuple[LeakVerdict, float]:
+    """本地判断回复是否泄露系统提示
+
+    回复中出现随机数标记或大段系统提示原文时直接拦截, 几乎没有重合时直接通过, 其余情况交给审查模型
+    """
+    if random_number is not None:
+        if str(random_number) in response:
+            return "block", 1.0
+        # 随机数每次都不同, 去掉后系统提示的片段可以复用缓存
+        system_prompt = system_prompt.replace(str(random_number), "")
+
+    score, matched = leakage_score(response, system_prompt)
+    if matched < config.min_match or score < config.pass_below:
+        return "pass", score
+    if score >= config.block_above:
+        return "block", score
+    return "audit", score
@@ -1,73 +1,173 @@
 import contextlib
 import tempfile
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterator, Iterator
 
 import fitz  # PyMuPDF
 import httpx
-from nonebot import logger
 
 from ..config import plugin_config
+from ..log import logger
+from ..metrics import payload_bytes_total, span
+from ..tokens import estimate_tokens
+from ..worker import WorkerPool
+from .pdf_layout import select_content
+from .url import UrlResponse
 
 config = plugin_config.pdf
+pdf_pool = WorkerPool("PDF解析", config.worker)
+
+
+async def _count_bytes(chunks: AsyncIterator[bytes]) -> AsyncGenerator[bytes]:
+    async for chunk in chunks:
+        payload_bytes_total.inc("pdf", amount=len(chunk))
+        yield chunk
+
+
+@contextlib.asynccontextmanager
+async def _open_pdf(url: str, source: UrlResponse | None) -> AsyncGenerator[tuple[int | None, AsyncIterator[bytes]]]:
+    if source is not None:
+        # 复用已经打开的响应, 不再重复请求
+        yield source.content_length, source.aiter_bytes()
+        return
+
+    async with (
+        httpx.AsyncClient() as client,
+        client.stream("GET", url, timeout=60.0, follow_redirects=True) as resp,
+    ):
+        try:
+            content_length = int(resp.raise_for_status().headers["Content-Length"])
+        except (KeyError, ValueError):
+            content_length = None
+        yield content_length, _count_bytes(resp.aiter_bytes(64 * 1024))  # 64KB
+
+
+def _too_large(size: int) -> None:
+    logger.error(f"PDF文件过大: {size / 1024 / 1024:.2f}MB, 超过{config.max_size / 1024 / 1024:.2f}MB限制")
 
 
 @contextlib.asynccontextmanager
-async def _download_pdf(url: str) -> AsyncGenerator[str | None]:
-    with tempfile.NamedTemporaryFile(suffix=".pdf") as temp:
+async def _download_pdf(url: str, source: UrlResponse | None = None) -> AsyncGenerator[str | bytearray | None]:
+    """下载PDF, 返回内存中的数据, 超过 spill_threshold 时转存到临时文件并返回文件名"""
+    with contextlib.ExitStack() as stack:
         try:
-            async with (
-                httpx.AsyncClient() as client,
-                client.stream("GET", url, timeout=60.0, follow_redirects=True) as resp,
-            ):
-                async for chunk in resp.raise_for_status().aiter_bytes(64 * 1024):  # 64KB
-                    temp.write(chunk)
-                    if temp.tell() > config.max_size:
-                        logger.error(f"PDF文件过大: {temp.tell() / 1024 / 1024:.2f}MB, 超过{config.max_size / 1024 / 1024:.2f}MB限制")
+            async with _open_pdf(url, source) as (content_length, chunks):
+                if content_length is not None and content_length > config.max_size:
+                    _too_large(content_length)
+                    yield None
+                    return
+
+                # 已知大小时预先分配, 避免反复扩容
+                buffer = bytearray(content_length) if content_length and content_length <= config.spill_threshold else bytearray()
+                temp = None
+                size = 0
+                async for chunk in chunks:
+                    end = size + len(chunk)
+                    if end > config.max_size:
+                        _too_large(end)
                         yield None
                         return
 
+                    if temp is None and end > config.spill_threshold:
+                        logger.info(f"PDF文件超过{config.spill_threshold / 1024 / 1024:.2f}MB, 转存到临时文件")
+                        temp = stack.enter_context(tempfile.NamedTemporaryFile(suffix=".pdf"))
+                        temp.write(memoryview(buffer)[:size])
+                        buffer = bytearray()
+
+                    if temp is not None:
+                        temp.write(chunk)
+                    else:
+                        buffer[size:end] = chunk
+                    size = end
+
         except httpx.HTTPError:
             logger.exception(f"下载PDF失败: {url}")
             yield None
         else:
-            temp.flush()
-            temp.seek(0)
-            yield temp.name
+            if temp is not None:
+                temp.flush()
+                yield temp.name
+            else:
+                # Content-Length 与实际大小不符时去掉多余的预分配空间
+                del buffer[size:]
+                yield buffer
+
+
+def iter_pdf_pages(doc: fitz.Document, max_pages: int) -> Iterator[str]:
+    """逐页提取文本"""
+    # 检查页数
+    if len(doc) > max_pages:
+        logger.info(f"PDF页数过多: {len(doc)}, 将只处理前{max_pages}页")
+
+    for page_num in range(min(len(doc), max_pages)):
+        yield doc.load_page(page_num).get_textpage().extractText()
+
+
+def _open_document(source: str | bytearray) -> fitz.Document:
+    return fitz.open(source) if isinstance(source, str) else fitz.open(stream=source, filetype="pdf")
+
+
+def _extract_pages(doc: fitz.Document, max_pages: int, max_chars: int) -> list[str]:
+    pages: list[str] = []
+    length = 0
+    for page_num, text in enumerate(iter_pdf_pages(doc, max_pages)):
+        pages.append(text)
+        length += len(text) + 1
+        if length > max_chars:
+            logger.info(f"PDF内容已超过{max_chars}个字符, 跳过第{page_num + 2}页及之后的页面")
+            break
+    return pages
+
+
+def extract_pdf_text(source: str | bytearray, max_pages: int, max_chars: int) -> str:
+    """提取PDF文本, 达到字符上限后不再解析后续页面
+
+    同步的 CPU 密集操作, 请通过 `pdf_pool` 调用
+    """
+    with _open_document(source) as doc:
+        full_text = "\n".join(_extract_pages(doc, max_pages, max_chars))
+
+    # 如果文本太长，截取前N个字符
+    if len(full_text) > max_chars:
+        logger.info(f"PDF内容过长，已截取前{max_chars}个字符，原长度: {len(full_text)}")
+        full_text = full_text[:max_chars] + "\n...[内容过长已截断]"
+
+    return full_text
+
+
+def extract_pdf_sections(source: str | bytearray, max_pages: int, max_chars: int, max_tokens: int) -> str:
+    """提取PDF文本, 去除页眉页脚后按目录章节分配 token 预算
+
+    同步的 CPU 密集操作, 请通过 `pdf_pool` 调用
+    """
+    with _open_document(source) as doc:
+        pages = _extract_pages(doc, max_pages, max_chars)
+        toc = doc.get_toc(simple=True)
+
+    content = select_content(pages, toc, max_tokens)
+    logger.info(f"PDF内容已按章节精简: {sum(map(len, pages))} -> {len(content)} 字符, 约 {estimate_tokens(content)} tokens")
+    return content
 
 
-async def process_pdf(url: str) -> str | None:
+async def process_pdf(url: str, source: UrlResponse | None = None) -> str | None:
     """处理PDF内容
 
     Args:
         url: PDF文件URL
+        source: 已经打开的链接响应, 提供时直接从中读取
 
     Returns:
         Optional[str]: PDF内容文本, 失败时返回None
     """
 
-    async with _download_pdf(url) as filename:
-        if filename is None:
+    async with _download_pdf(url, source) as data:
+        if data is None:
             return None
 
         try:
-            with fitz.open(filename) as doc:
-                # 检查页数
-                if len(doc) > (max_pages := config.max_pages):
-                    logger.info(f"PDF页数过多: {len(doc)}, 将只处理前{max_pages}页")
-                    page_count = max_pages
-                else:
-                    page_count = len(doc)
-
-                # 提取文本
-                full_text = "\n".join(doc.load_page(page_num).get_textpage().extractText() for page_num in range(page_count))
-
+            with span("pdf_parse"):
+                if config.mode == "smart":
+                    return await pdf_pool.run(extract_pdf_sections, data, config.max_pages, config.max_chars, config.max_tokens)
+                return await pdf_pool.run(extract_pdf_text, data, config.max_pages, config.max_chars)
         except Exception:
             logger.exception(f"处理PDF失败: {url}")
             return None
-
-    # 如果文本太长，截取前N个字符
-    if len(full_text) > (max_chars := config.max_chars):
-        logger.info(f"PDF内容过长，已截取前{max_chars}个字符，原长度: {len(full_text)}")
-        full_text = full_text[:max_chars] + "\n...[内容过长已截断]"
-
-    return full_text
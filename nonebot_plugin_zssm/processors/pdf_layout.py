@@ -0,0 +1,112 @@
+import re
+from collections import Counter
+
+from ..tokens import allocate_budget, estimate_tokens, truncate_tokens
+
+PATTERN_DIGITS = re.compile(r"\d+")
+PATTERN_PAGE_NUMBER = re.compile(
+    r"^(?:page\s*)?[-–—\s]*\d+(?:\s*(?:/|of)\s*\d+)?[-–—\s]*$|^第\s*\d+\s*页(?:\s*共\s*\d+\s*页)?$", re.IGNORECASE
+)
+PATTERN_HYPHEN = re.compile(r"([A-Za-z])-\n([a-z])")
+PATTERN_BLANK_LINES = re.compile(r"\n{3,}")
+PATTERN_REFERENCES = re.compile(r"^\s*(?:\d+\.?\s*)?(references|bibliography|参考文献|引用文献)\s*$", re.IGNORECASE)
+
+TRUNCATED_MARKER = "\n...[本节过长已截断]"
+EDGE_LINES = 3  # 页眉页脚只在每页开头和结尾的几行中查找
+
+
+class Section:
+    def __init__(self, title: str | None, text: str) -> None:
+        self.title = title
+        self.text = text
+        self.tokens = estimate_tokens(text)
+
+
+def _normalize_line(line: str) -> str:
+    return PATTERN_DIGITS.sub("#", line.strip().lower())
+
+
+def strip_page_furniture(pages: list[str]) -> list[str]:
+    """去除每页重复出现的页眉、页脚和页码"""
+    page_lines = [[line for line in page.splitlines() if line.strip()] for page in pages]
+
+    def edges(lines: list[str]) -> int:
+        # 行数很少的页面只检查首尾各一行, 避免把正文当成页眉页脚
+        return max(1, min(EDGE_LINES, len(lines) // 3))
+
+    counter: Counter[str] = Counter()
+    for lines in page_lines:
+        edge = edges(lines)
+        counter.update({_normalize_line(line) for line in lines[:edge] + lines[-edge:]})
+    threshold = max(3, len(pages) // 2)
+    repeated = {line for line, count in counter.items() if count >= threshold} if len(pages) >= 3 else set()
+
+    def is_furniture(line: str) -> bool:
+        return bool(PATTERN_PAGE_NUMBER.match(line.strip())) or _normalize_line(line) in repeated
+
+    result: list[str] = []
+    for lines in page_lines:
+        head = min(edges(lines), len(lines))
+        tail = max(head, len(lines) - edges(lines))
+        kept = [line for i, line in enumerate(lines) if not ((i < head or i >= tail) and is_furniture(line))]
+        result.append("\n".join(kept))
+    return result
+
+
+def dehyphenate(text: str) -> str:
+    """合并因换行被连字符断开的英文单词"""
+    return PATTERN_BLANK_LINES.sub("\n\n", PATTERN_HYPHEN.sub(r"\1\2", text))
+
+
+def _drop_references(text: str) -> str:
+    lines = text.splitlines()
+    # 只在后半部分查找参考文献标题, 避免误删目录中的条目
+    for i in range(len(lines) - 1, len(lines) // 2 - 1, -1):
+        if PATTERN_REFERENCES.match(lines[i]):
+            return "\n".join(lines[:i])
+    return text
+
+
+def split_sections(pages: list[str], toc: list[list]) -> list[Section]:
+    """按 PDF 目录划分章节, 没有目录时按页划分
+
+    Args:
+        pages: 每页的文本
+        toc: `Document.get_toc()` 的结果, 每项为 [层级, 标题, 页码(从1开始)]
+    """
+    entries = [(title, page - 1) for level, title, page, *_ in toc if level == 1 and 0 < page <= len(pages)]
+    if len(entries) < 2:
+        sections = [Section(None, dehyphenate(page)) for page in pages]
+        if sections:
+            sections[-1] = Section(None, _drop_references(sections[-1].text))
+        return [section for section in sections if section.text.strip()]
+
+    sections: list[Section] = []
+    if entries[0][1] > 0:
+        sections.append(Section(None, dehyphenate("\n".join(pages[: entries[0][1]]))))
+    for i, (title, start) in enumerate(entries):
+        if PATTERN_REFERENCES.match(title):
+            continue
+        end = entries[i + 1][1] if i + 1 < len(entries) else len(pages)
+        if end <= start:
+            # 与下一章节从同一页开始, 这一页只归下一章节, 避免重复
+            continue
+        text = "\n".join(pages[start:end])
+        sections.append(Section(title.strip(), dehyphenate(text)))
+    return [section for section in sections if section.text.strip()]
+
+
+def select_content(pages: list[str], toc: list[list], max_tokens: int) -> str:
+    """去除页面装饰后按章节分配 token 预算, 每个章节保留开头部分"""
+    sections = split_sections(strip_page_furniture(pages), toc)
+    headings = [f"## {section.title}\n" if section.title else "" for section in sections]
+    sizes = [section.tokens + estimate_tokens(heading) for section, heading in zip(sections, headings, strict=True)]
+    allocation = allocate_budget(sizes, max_tokens)
+
+    parts: list[str] = []
+    for section, heading, size, tokens in zip(sections, headings, sizes, allocation, strict=True):
+        if tokens >= size:
+            parts.append(heading + section.text)
+        elif (remaining := tokens - estimate_tokens(heading + TRUNCATED_MARKER)) > 0:
+            parts.append(heading + truncate_tokens(section.text, remaining) + TRUNCATED_MARKER)
+    return "\n\n".join(parts)
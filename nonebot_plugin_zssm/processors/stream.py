@@ -0,0 +1,111 @@
+import json
+import re
+
+PATTERN_OUTPUT_KEY = re.compile(r'"output"\s*:\s*"')
+PATTERN_BLOCK = re.compile(r'"block"\s*:\s*(true|false)')
+PATTERN_SENTENCE_END = re.compile(r"[。！？；!?;…\n]+[”」』）)]*")
+
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class OutputExtractor:
+    """从流式返回的 JSON 中逐步取出 `output` 字段的字符串值
+
+    只处理 `output` 的值, 其余字段仍在完整响应到达后由 `extract_output_safe` 解析;
+    `block` 出现在 `output` 之前时记录在 `block` 中, 否则为 None
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._started = False
+        self.done = False
+        self.block: bool | None = None
+
+    def feed(self, chunk: str) -> str:
+        """传入新的响应片段, 返回新解码出的 output 内容"""
+        if self.done:
+            return ""
+
+        self._buffer += chunk
+        if not self._started:
+            match = PATTERN_OUTPUT_KEY.search(self._buffer)
+            end = match.start() if match is not None else len(self._buffer)
+            if self.block is None and (block := PATTERN_BLOCK.search(self._buffer, 0, end)) is not None:
+                self.block = block.group(1) == "true"
+            if match is None:
+                # 只保留可能是键名开头的尾部, 避免缓冲区无限增长
+                self._buffer = self._buffer[-32:]
+                return ""
+            self._started = True
+            self._buffer = self._buffer[match.end() :]
+
+        result: list[str] = []
+        i = 0
+        buffer = self._buffer
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char != "\\":
+                end = i + 1
+                while end < len(buffer) and buffer[end] not in '"\\':
+                    end += 1
+                result.append(buffer[i:end])
+                i = end
+                continue
+
+            # 转义序列可能被拆到下一个片段中
+            if i + 1 >= len(buffer):
+                break
+            if buffer[i + 1] == "u":
+                if i + 6 > len(buffer):
+                    break
+                sequence = buffer[i : i + 6]
+                code = sequence[2:]
+                # 代理对需要连同下一个 \uXXXX 一起解码
+                if code.isascii() and code.upper().startswith(("D8", "D9", "DA", "DB")):
+                    if i + 12 > len(buffer):
+                        break
+                    sequence = buffer[i : i + 12]
+                try:
+                    result.append(json.loads(f'"{sequence}"'))
+                except ValueError:
+                    result.append(sequence)
+                i += len(sequence)
+            else:
+                result.append(ESCAPES.get(buffer[i + 1], buffer[i + 1]))
+                i += 2
+
+        self._buffer = buffer[i:]
+        return "".join(result)
+
+
+class SentenceChunker:
+    """把逐步到达的文本按句子边界切分, 每段至少 `min_length` 个字符
+
+    切出的各段原样拼接后是输入的前缀, 只会丢弃末尾的空白
+    """
+
+    def __init__(self, min_length: int) -> None:
+        self.min_length = min_length
+        self._pending = ""
+
+    def feed(self, text: str) -> str | None:
+        self._pending += text
+        if len(self._pending) < self.min_length:
+            return None
+
+        last_end = None
+        for match in PATTERN_SENTENCE_END.finditer(self._pending, self.min_length - 1):
+            last_end = match.end()
+        if last_end is None or not self._pending[:last_end].strip():
+            return None
+
+        chunk, self._pending = self._pending[:last_end], self._pending[last_end:]
+        return chunk
+
+    def flush(self) -> str | None:
+        chunk, self._pending = self._pending, ""
+        return chunk if chunk.strip() else None
@@ -0,0 +1,224 @@
+import contextlib
+import json
+import time
+from collections.abc import AsyncGenerator, AsyncIterator
+from typing import Literal
+
+import httpx
+from nonebot.compat import model_dump, type_validate_json
+from nonebot_plugin_localstore import get_plugin_data_file
+from pydantic import BaseModel, ValidationError
+from yarl import URL
+
+from ..cache import TieredCache
+from ..config import plugin_config
+from ..log import logger
+from ..metrics import payload_bytes_total, span
+
+config = plugin_config.url
+cache_config = config.cache
+
+url_cache = TieredCache(
+    "链接内容",
+    max_entries=cache_config.max_entries,
+    ttl=cache_config.ttl,
+    disk_path=get_plugin_data_file("url_cache.db") if cache_config.disk else None,
+    disk_max_entries=cache_config.disk_max_entries,
+)
+
+
+class UrlCacheEntry(BaseModel):
+    kind: str
+    content: str
+    etag: str | None = None
+    last_modified: str | None = None
+    stored_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+    @property
+    def revalidatable(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+
+def normalize_url(url: str) -> str:
+    """规范化URL作为缓存键: 忽略片段, 排序查询参数, 去掉默认端口"""
+    try:
+        uri = URL(url)
+    except ValueError:
+        return url
+    uri = uri.with_fragment(None).with_query(sorted(uri.query.items()))
+    if uri.explicit_port is not None and uri.is_default_port():
+        uri = uri.with_port(None)
+    return str(uri)
+
+
+def ttl_of(kind: str) -> int:
+    return cache_config.ttl_by_type.get(kind, cache_config.ttl)
+
+
+def _storage_ttl(entry: UrlCacheEntry) -> int:
+    # 有验证器的内容过期后仍保留一段时间, 用于发起条件请求
+    return max(ttl_of(entry.kind), cache_config.stale_ttl) if entry.revalidatable else ttl_of(entry.kind)
+
+
+async def _revalidate(url: str, entry: UrlCacheEntry) -> bool:
+    headers: dict[str, str] = {}
+    if entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+
+    try:
+        async with (
+            httpx.AsyncClient() as client,
+            client.stream("GET", url, headers=headers, timeout=15.0, follow_redirects=True) as resp,
+        ):
+            # 内容有变化时不读取响应体, 交给正常的处理流程
+            return resp.status_code == 304
+    except httpx.HTTPError as e:
+        logger.warning(f"链接缓存重新验证失败: {url}, {e!r}")
+        return False
+
+
+async def get_cached_content(url: str) -> UrlCacheEntry | None:
+    """获取链接内容缓存, 过期的缓存会用 ETag/Last-Modified 发起条件请求重新验证"""
+    if not cache_config.enabled:
+        return None
+
+    key = normalize_url(url)
+    if (raw := await url_cache.get(key)) is None:
+        return None
+
+    try:
+        entry = type_validate_json(UrlCacheEntry, raw)
+    except ValidationError:
+        await url_cache.delete(key)
+        return None
+
+    if entry.age < ttl_of(entry.kind):
+        logger.info(f"链接内容命中缓存: {key}" + (f", {url_cache.stats}" if cache_config.log_stats else ""))
+        return entry
+
+    if entry.revalidatable and await _revalidate(url, entry):
+        logger.info(f"链接内容未修改, 继续使用缓存: {key}")
+        entry.stored_at = time.time()
+        await url_cache.set(key, json.dumps(model_dump(entry)), _storage_ttl(entry))
+        return entry
+
+    await url_cache.delete(key)
+    return None
+
+
+async def cache_content(url: str, kind: str, content: str, headers: httpx.Headers | None = None) -> None:
+    if not cache_config.enabled:
+        return
+
+    entry = UrlCacheEntry(
+        kind=kind,
+        content=content,
+        etag=headers.get("ETag") if headers else None,
+        last_modified=headers.get("Last-Modified") if headers else None,
+        stored_at=time.time(),
+    )
+    await url_cache.set(normalize_url(url), json.dumps(model_dump(entry)), _storage_ttl(entry))
+
+
+UrlKind = Literal["pdf", "html", "image", "text", "unknown"]
+
+IMAGE_MAGIC = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a", b"BM")
+
+
+def sniff_kind(content_type: str, head: bytes) -> UrlKind:
+    """根据 Content-Type 和响应开头的字节判断内容类型, 文件头优先"""
+    content_type = content_type.split(";", 1)[0].strip().lower()
+
+    if b"%PDF-" in head[:1024]:
+        return "pdf"
+    if head.startswith(IMAGE_MAGIC) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP"):
+        return "image"
+
+    prefix = head[:512].lstrip().lower()
+    if content_type in {"text/html", "application/xhtml+xml"} or prefix.startswith((b"<!doctype html", b"<html")):
+        return "html"
+    if content_type == "application/pdf":
+        return "pdf"
+    if content_type.startswith("image/"):
+        return "image"
+    if content_type.startswith("text/") or content_type in {"application/json", "application/xml"} or content_type.endswith("+json"):
+        return "text"
+    return "unknown"
+
+
+class UrlResponse:
+    """已打开的链接响应, 开头的数据块已被读取用于判断类型, 剩余内容可以继续流式读取"""
+
+    def __init__(self, url: str, response: httpx.Response, head: bytes, chunks: AsyncIterator[bytes]) -> None:
+        self.url = url
+        self.response = response
+        self.head = head
+        self.kind = sniff_kind(response.headers.get("Content-Type", ""), head)
+        self._chunks = chunks
+        self._consumed = False
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self.response.headers
+
+    @property
+    def content_length(self) -> int | None:
+        try:
+            return int(self.headers["Content-Length"])
+        except (KeyError, ValueError):
+            return None
+
+    async def aiter_bytes(self) -> AsyncGenerator[bytes, None]:
+        """从头开始读取响应体, 只能调用一次"""
+        assert not self._consumed, "响应体已被读取"
+        self._consumed = True
+        if self.head:
+            payload_bytes_total.inc(self.kind, amount=len(self.head))
+            yield self.head
+        async for chunk in self._chunks:
+            payload_bytes_total.inc(self.kind, amount=len(chunk))
+            yield chunk
+
+    async def read(self, limit: int, *, truncate: bool = False) -> bytes | None:
+        """读取整个响应体, 超过 limit 时截断或返回 None, 读取中途出错时也返回 None"""
+        data = bytearray()
+        try:
+            async for chunk in self.aiter_bytes():
+                data += chunk
+                if len(data) > limit:
+                    if truncate:
+                        return bytes(data[:limit])
+                    logger.error(f"链接内容过大: {self.url}, 超过{limit / 1024 / 1024:.2f}MB限制")
+                    return None
+        except httpx.HTTPError as e:
+            logger.warning(f"读取链接内容失败: {self.url}, {e!r}")
+            return None
+        return bytes(data)
+
+    async def read_text(self, limit: int) -> str | None:
+        if (data := await self.read(limit, truncate=True)) is None:
+            return None
+        return data.decode(self.response.encoding or "utf-8", errors="replace")
+
+
+@contextlib.asynccontextmanager
+async def open_url(url: str) -> AsyncGenerator[UrlResponse | None, None]:
+    """用一次流式 GET 请求打开链接并判断内容类型, 失败时返回 None"""
+    async with contextlib.AsyncExitStack() as stack:
+        try:
+            with span("url_sniff"):
+                client = await stack.enter_async_context(httpx.AsyncClient())
+                resp = await stack.enter_async_context(client.stream("GET", url, timeout=config.timeout, follow_redirects=True))
+                chunks = resp.raise_for_status().aiter_bytes(64 * 1024)  # 64KB
+                head = await anext(chunks, b"")
+        except httpx.HTTPError as e:
+            logger.warning(f"打开链接失败: {url}, {e!r}")
+            yield None
+        else:
+            yield UrlResponse(url, resp, head, chunks)
@@ -1,10 +1,213 @@
-from nonebot import logger
+import asyncio
+import codecs
+import contextlib
+import re
+import time
+from html.parser import HTMLParser
+
+import httpx
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import Page
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from yarl import URL
 
-from ..browser import get_browser
+from ..browser import page_pool
 from ..config import plugin_config
+from ..log import logger
+from ..metrics import span
+from .url import UrlResponse
+
+config = plugin_config.web
+browser_config = plugin_config.browser
+
+PATTERN_CHARSET = re.compile(rb"<meta[^>]+charset=[\"']?([\w-]+)", re.IGNORECASE)
+PATTERN_JS_REQUIRED = re.compile(
+    r"(enable|turn on|requires?) javascript|javascript (is )?(required|disabled)|(启用|开启|打开).{0,4}javascript", re.IGNORECASE
+)
+
+# 不包括 head: HTML 允许省略 </head>, 跳过 head 会连正文一起跳过; head 中有文本的只有 title 和脚本样式
+SKIP_TAGS = frozenset(
+    {"script", "style", "noscript", "template", "svg", "canvas", "iframe", "title", "nav", "footer", "aside", "form", "button"}
+)
+BLOCK_TAGS = frozenset(
+    {
+        *("p", "div", "section", "article", "main", "header", "blockquote", "pre", "figure", "figcaption"),
+        *("h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "li", "dl", "dt", "dd", "table", "tr", "br", "hr"),
+    },
+)
+MAIN_TAGS = frozenset({"main", "article"})
+VOID_TAGS = frozenset({"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"})
+
+
+class HTMLTextExtractor(HTMLParser):
+    """流式提取 HTML 中的可见文本, 同时单独收集 <main>/<article> 中的正文"""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.main_parts: list[str] = []
+        self.noscript_parts: list[str] = []
+        self.script_size = 0
+        self._stack: list[str] = []
+        self._skip_depth = 0
+        self._main_depth = 0
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:  # noqa: ARG002
+        if tag in VOID_TAGS:
+            if tag in BLOCK_TAGS:
+                self._newline()
+            return
+
+        self._stack.append(tag)
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in MAIN_TAGS:
+            self._main_depth += 1
+        if tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag not in self._stack:
+            return
+
+        # 不规范的 HTML 可能缺少结束标签, 一并弹出
+        while self._stack:
+            current = self._stack.pop()
+            if current in SKIP_TAGS:
+                self._skip_depth -= 1
+            elif current in MAIN_TAGS:
+                self._main_depth -= 1
+            if current == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_data(self, data: str) -> None:
+        current = self._stack[-1] if self._stack else ""
+        if current == "script":
+            self.script_size += len(data)
+        elif current == "noscript":
+            self.noscript_parts.append(data)
+        if self._skip_depth or not data.strip():
+            return
+
+        self.parts.append(data)
+        if self._main_depth:
+            self.main_parts.append(data)
+
+    def _newline(self) -> None:
+        self.parts.append("\n")
+        if self._main_depth:
+            self.main_parts.append("\n")
+
+    @staticmethod
+    def _normalize(parts: list[str]) -> str:
+        lines = (" ".join(line.split()) for line in "".join(parts).splitlines())
+        return "\n".join(line for line in lines if line)
+
+    @property
+    def text(self) -> str:
+        return self._normalize(self.parts)
+
+    @property
+    def main_text(self) -> str:
+        return self._normalize(self.main_parts)
+
+    @property
+    def noscript_text(self) -> str:
+        return self._normalize(self.noscript_parts)
+
+
+def _match_domain(host: str, domains: list[str]) -> bool:
+    return any(host == domain or host.endswith(f".{domain}") for domain in domains)
+
+
+def needs_browser(url: str) -> bool:
+    """是否跳过直接请求, 直接使用浏览器"""
+    return not config.fast_path or _match_domain(URL(url).host or "", config.browser_domains)
+
+
+def looks_js_gated(extractor: HTMLTextExtractor, text: str) -> bool:
+    """判断直接请求得到的页面是否依赖 JavaScript 渲染"""
+    if len(text) < config.min_text_length:
+        return True
+    if PATTERN_JS_REQUIRED.search(extractor.noscript_text) and len(text) < config.min_text_length * 5:
+        return True
+    # 脚本远多于文本的页面通常是单页应用的外壳
+    return extractor.script_size > len(text) * 50
+
+
+async def extract_static_page(source: UrlResponse) -> str | None:
+    """从已经打开的 HTML 响应中直接提取正文, 需要浏览器渲染时返回 None
+
+    Args:
+        source: 已经打开的链接响应
+
+    Returns:
+        Optional[str]: 网页正文, 需要浏览器时返回None
+    """
+    charset = source.response.charset_encoding
+    if charset is None and (match := PATTERN_CHARSET.search(source.head[:4096])):
+        charset = match.group(1).decode("ascii")
+    try:
+        decoder = codecs.getincrementaldecoder(charset or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    extractor = HTMLTextExtractor()
+    size = 0
+    try:
+        async for chunk in source.aiter_bytes():
+            extractor.feed(decoder.decode(chunk))
+            if (size := size + len(chunk)) > config.max_html_size:
+                logger.warning(f"HTML 过大, 只解析前 {config.max_html_size / 1024 / 1024:.2f}MB: {source.url}")
+                break
+    except httpx.HTTPError as e:
+        # 读取中断时交给浏览器重新加载
+        logger.warning(f"读取网页内容失败, 改用浏览器: {source.url}, {e!r}")
+        return None
+    extractor.feed(decoder.decode(b"", final=True))
+    extractor.close()
+
+    main_text = extractor.main_text
+    text = main_text if len(main_text) >= config.min_text_length else extractor.text
+
+    if _match_domain(URL(source.url).host or "", config.static_domains):
+        return text or None
+    if looks_js_gated(extractor, text):
+        logger.info(f"页面内容过少或依赖 JavaScript, 改用浏览器: {source.url}, {len(text)} 字")
+        return None
+
+    logger.info(f"直接提取网页正文: {source.url}, {len(text)} 字")
+    return text
+
+
+async def _wait_for_stable_text(page: Page) -> None:
+    """等待页面文本长度不再变化"""
+    deadline = time.monotonic() + browser_config.text_stable_timeout / 1000
+    last_length = -1
+    while time.monotonic() < deadline:
+        try:
+            length: int = await page.evaluate("() => document.body ? document.body.innerText.length : 0")
+        except PlaywrightError:
+            # 页面跳转时执行上下文会被销毁, 等新页面加载后继续检查
+            length = -1
+        if length > 0 and length == last_length:
+            return
+        last_length = length
+        await asyncio.sleep(0.3)
+
+
+async def _navigate(page: Page, url: str) -> None:
+    if browser_config.navigation == "full":
+        await page.goto(url, timeout=60000)
+        return
 
-config = plugin_config.browser
+    # 只等待 DOM 加载和短暂的网络空闲, 文本稳定后立即提取
+    await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+    with contextlib.suppress(PlaywrightTimeoutError):
+        await page.wait_for_load_state("networkidle", timeout=browser_config.network_idle_timeout)
+    await _wait_for_stable_text(page)
 
 
 async def process_web_page(url: str) -> str | None:
@@ -17,22 +220,10 @@ async def process_web_page(url: str) -> str | None:
         Optional[str]: 网页内容, 失败时返回None
     """
     try:
-        if config.proxy:
-            proxy_uri = URL(config.proxy)
-            proxy = {
-                "server": f"{proxy_uri.scheme}://{proxy_uri.host}:{proxy_uri.port}",
-                "username": proxy_uri.user,
-                "password": proxy_uri.password,
-            }
-        else:
-            proxy = None
-
-        logger.info(f"使用代理: {proxy} - {config.proxy}")
-        browser = await get_browser(proxy=proxy)
-
-        async with await browser.new_page() as page:
+        async with page_pool.acquire() as page:
             try:
-                await page.goto(url, timeout=60000)
+                with span("browser_navigation"):
+                    await _navigate(page, url)
             except Exception:
                 logger.exception(f"打开链接失败: {url}")
                 return None
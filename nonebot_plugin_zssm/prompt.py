@@ -0,0 +1,66 @@
+from typing import NamedTuple
+
+from .config import plugin_config
+from .log import logger
+from .metrics import tokens_total
+from .tokens import allocate_budget, count_tokens, truncate_to_tokens
+
+config = plugin_config.prompt
+
+TRUNCATED_MARKER = "\n...[内容过长已截断]"
+
+
+class PromptSection(NamedTuple):
+    """用户提示中的一部分, 超出预算时只截断 content, 保留首尾的标签"""
+
+    name: str  # 预算分类, 对应 `prompt.shares` 的键
+    head: str
+    content: str
+    tail: str
+
+    def render(self, content: str | None = None) -> str:
+        return f"{self.head}{self.content if content is None else content}{self.tail}"
+
+
+def _share_budget(sizes: dict[str, int], budget: int) -> dict[str, int]:
+    """先按占比分配预算, 用不完的预算再平均分给仍然超出的部分"""
+    total_share = sum(config.shares.get(name, 0.0) for name in sizes) or 1.0
+    quotas = {name: int(budget * config.shares.get(name, 0.0) / total_share) for name in sizes}
+    allocation = {name: min(size, quotas[name]) for name, size in sizes.items()}
+
+    names = list(sizes)
+    extra = allocate_budget([sizes[name] - allocation[name] for name in names], budget - sum(allocation.values()))
+    return {name: allocation[name] + tokens for name, tokens in zip(names, extra, strict=True)}
+
+
+def fit_sections(sections: list[PromptSection]) -> str:
+    """把各部分压缩到 `prompt.max_tokens` 以内并拼接, 记录每部分的 token 数"""
+    sizes = [count_tokens(section.content) for section in sections]
+    overhead = sum(count_tokens(section.head + section.tail) for section in sections)
+
+    group_sizes: dict[str, int] = {}
+    for section, size in zip(sections, sizes, strict=True):
+        group_sizes[section.name] = group_sizes.get(section.name, 0) + size
+    group_budget = _share_budget(group_sizes, max(0, config.max_tokens - overhead))
+
+    # 同一分类的多个部分(如多张图片)平分该分类的预算
+    allocation = [0] * len(sections)
+    for name, budget in group_budget.items():
+        indexes = [i for i, section in enumerate(sections) if section.name == name]
+        for i, tokens in zip(indexes, allocate_budget([sizes[i] for i in indexes], budget), strict=True):
+            allocation[i] = tokens
+
+    parts: list[str] = []
+    used: dict[str, int] = dict.fromkeys(group_sizes, 0)
+    for section, size, tokens in zip(sections, sizes, allocation, strict=True):
+        if tokens >= size:
+            content = section.content
+        else:
+            content = truncate_to_tokens(section.content, tokens - count_tokens(TRUNCATED_MARKER)) + TRUNCATED_MARKER
+        used[section.name] += count_tokens(content)
+        parts.append(section.render(content))
+
+    breakdown = ", ".join(f"{name} {used[name]}" + (f"/{size}" if used[name] < size else "") for name, size in group_sizes.items())
+    tokens_total.inc("prompt", amount=sum(used.values()) + overhead)
+    logger.info(f"用户提示 token 数: {sum(used.values()) + overhead}/{config.max_tokens} ({breakdown}, 标签 {overhead})")
+    return "".join(parts)
@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import math
+import time
+from collections import deque
+from collections.abc import AsyncGenerator
+from typing import Any, Self
+
+from .api import AsyncChatClient, CompletionMessage, StreamDelta
+from .config import LLMConfig, LLMEndpointConfig, plugin_config
+from .log import logger
+
+config = plugin_config.router
+
+TYPICAL_TOKENS = 500  # 估算一次回答总耗时时假设的输出长度
+
+
+class EndpointStats:
+    """单个端点的滚动统计: 首字延迟、生成速度、错误率和熔断状态"""
+
+    def __init__(self) -> None:
+        self.ttft: float | None = None
+        self.tokens_per_second: float | None = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+        self.ttft_samples: deque[float] = deque(maxlen=100)
+
+    @staticmethod
+    def _ewma(old: float | None, new: float) -> float:
+        return new if old is None else old + config.ewma_alpha * (new - old)
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    @property
+    def score(self) -> float | None:
+        """预计一次回答的耗时, 按错误率加权, 越小越好; 没有数据时返回 None"""
+        if self.ttft is None:
+            return None
+        generate = TYPICAL_TOKENS / self.tokens_per_second if self.tokens_per_second else 0.0
+        return (self.ttft + generate) / max(0.05, 1 - self.error_rate)
+
+    def hedge_delay(self) -> float:
+        if len(self.ttft_samples) < 5:
+            return config.hedge_min_delay
+        samples = sorted(self.ttft_samples)
+        index = min(len(samples) - 1, math.ceil(config.hedge_percentile * len(samples)) - 1)
+        return max(config.hedge_min_delay, samples[index])
+
+    def record_success(self, ttft: float, tokens: int = 0, duration: float = 0.0) -> None:
+        self.ttft = self._ewma(self.ttft, ttft)
+        self.ttft_samples.append(ttft)
+        if tokens > 1 and duration > 0:
+            self.tokens_per_second = self._ewma(self.tokens_per_second, tokens / duration)
+        self.error_rate = self._ewma(self.error_rate, 0.0)
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self) -> None:
+        self.error_rate = self._ewma(self.error_rate, 1.0)
+        self.failures += 1
+        if self.failures >= config.failure_threshold:
+            self.open_until = time.monotonic() + config.cooldown
+
+    def __str__(self) -> str:
+        ttft = f"{self.ttft:.2f}s" if self.ttft is not None else "-"
+        speed = f"{self.tokens_per_second:.1f}/s" if self.tokens_per_second is not None else "-"
+        return f"首字 {ttft}, 速度 {speed}, 错误率 {self.error_rate:.0%}"
+
+
+_stats: dict[tuple[str, str], EndpointStats] = {}
+
+
+def get_stats(endpoint: LLMEndpointConfig) -> EndpointStats:
+    key = (endpoint.endpoint, endpoint.name)
+    if (stats := _stats.get(key)) is None:
+        stats = _stats[key] = EndpointStats()
+    return stats
+
+
+def rank_endpoints(llm_config: LLMConfig) -> list[LLMEndpointConfig]:
+    """按预计耗时排列可用的端点, 没有数据的端点按配置顺序排在后面; 全部熔断时按恢复时间排列"""
+    endpoints: list[LLMEndpointConfig] = [llm_config, *llm_config.backups]
+    available = [endpoint for endpoint in endpoints if get_stats(endpoint).available]
+    if not available:
+        return sorted(endpoints, key=lambda endpoint: get_stats(endpoint).open_until)
+
+    def key(endpoint: LLMEndpointConfig) -> tuple[bool, float]:
+        score = get_stats(endpoint).score
+        return score is None, score or 0.0
+
+    return sorted(available, key=key)
+
+
+class _Attempt:
+    """向单个端点发起的一次流式请求, 等待第一个增量"""
+
+    def __init__(
+        self, endpoint: LLMEndpointConfig, timeout: float | None, messages: tuple[CompletionMessage, ...], kwargs: Any
+    ) -> None:
+        self.endpoint = endpoint
+        self.client = AsyncChatClient(endpoint, timeout)
+        self.stream = self.client.stream_delta(*messages, **kwargs)
+        self.started = time.monotonic()
+        self.first: asyncio.Future[StreamDelta | None] = asyncio.ensure_future(anext(self.stream, None))
+
+    async def close(self) -> None:
+        self.first.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await self.first
+        with contextlib.suppress(Exception):
+            await self.stream.aclose()
+
+
+class RoutedChatClient:
+    """在多个端点之间选择的对话客户端, 接口与 `AsyncChatClient` 相同
+
+    按滚动统计选择最快的端点, 连续失败的端点暂停使用;
+    开启对冲时, 首字延迟超过历史分位数会同时请求下一个端点, 采用先返回的结果并取消另一个
+    """
+
+    def __init__(self, llm_config: LLMConfig, timeout: float | None = None) -> None:
+        self.config = llm_config
+        self.timeout = timeout
+        self._client: AsyncChatClient | None = None
+
+    @property
+    def content(self) -> str:
+        return self._client.content if self._client is not None else ""
+
+    @property
+    def reasoning_content(self) -> str:
+        return self._client.reasoning_content if self._client is not None else ""
+
+    @property
+    def completion_tokens(self) -> int:
+        return self._client.completion_tokens if self._client is not None else 0
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def create(self, *messages: CompletionMessage, **kwargs: Any) -> dict:
+        last_error: Exception | None = None
+        for endpoint in rank_endpoints(self.config):
+            stats = get_stats(endpoint)
+            client = AsyncChatClient(endpoint, self.timeout)
+            started = time.monotonic()
+            try:
+                response = await client.create(*messages, **kwargs)
+            except Exception as e:
+                stats.record_failure()
+                logger.warning(f"端点请求失败: {endpoint.name}@{endpoint.endpoint}, {e!r}, {stats}")
+                last_error = e
+                continue
+            stats.record_success(time.monotonic() - started)
+            self._client = client
+            return response
+
+        assert last_error is not None
+        raise last_error
+
+    async def _first_response(self, messages: tuple[CompletionMessage, ...], kwargs: Any) -> tuple[_Attempt, float]:
+        """依次尝试各端点直到收到第一个增量, 返回成功的请求和首字延迟"""
+        pending = rank_endpoints(self.config)
+        attempts: list[_Attempt] = []
+        hedged = False
+        last_error: BaseException | None = None
+
+        def start_next() -> None:
+            endpoint = pending.pop(0)
+            logger.debug(f"请求端点: {endpoint.name}@{endpoint.endpoint}, {get_stats(endpoint)}")
+            attempts.append(_Attempt(endpoint, self.timeout, messages, kwargs))
+
+        start_next()
+        try:
+            while attempts:
+                timeout = None
+                if config.hedge and pending and not hedged and len(attempts) == 1:
+                    attempt = attempts[0]
+                    timeout = max(0.0, get_stats(attempt.endpoint).hedge_delay() - (time.monotonic() - attempt.started))
+
+                done, _ = await asyncio.wait(
+                    [attempt.first for attempt in attempts], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                now = time.monotonic()
+                if not done:
+                    hedged = True
+                    logger.info(f"端点 {attempts[0].endpoint.name} 首字延迟超过 {now - attempts[0].started:.1f}s, 同时请求下一个端点")
+                    start_next()
+                    continue
+
+                for attempt in [attempt for attempt in attempts if attempt.first in done]:
+                    if (error := attempt.first.exception()) is None:
+                        attempts.remove(attempt)
+                        return attempt, now - attempt.started
+                    attempts.remove(attempt)
+                    get_stats(attempt.endpoint).record_failure()
+                    logger.warning(f"端点请求失败: {attempt.endpoint.name}@{attempt.endpoint.endpoint}, {error!r}")
+                    last_error = error
+                    await attempt.close()
+
+                if not attempts and pending:
+                    start_next()
+        finally:
+            # 输掉竞争或请求被取消时关闭其余请求
+            await asyncio.gather(*(attempt.close() for attempt in attempts))
+
+        assert last_error is not None
+        raise last_error
+
+    async def stream_delta(self, *messages: CompletionMessage, **kwargs: Any) -> AsyncGenerator[StreamDelta, None]:
+        attempt, ttft = await self._first_response(messages, kwargs)
+        self._client = attempt.client
+        stats = get_stats(attempt.endpoint)
+
+        try:
+            if (first := attempt.first.result()) is not None:
+                yield first
+                async for delta in attempt.stream:
+                    yield delta
+        except Exception:
+            stats.record_failure()
+            raise
+        finally:
+            await attempt.stream.aclose()
+
+        stats.record_success(ttft, attempt.client.completion_tokens, time.monotonic() - attempt.started - ttft)
+        logger.debug(f"端点响应完成: {attempt.endpoint.name}@{attempt.endpoint.endpoint}, {stats}")
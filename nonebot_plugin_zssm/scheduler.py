@@ -0,0 +1,193 @@
+import asyncio
+import contextlib
+import time
+from collections import Counter, deque
+from collections.abc import AsyncGenerator, Awaitable, Callable
+
+from .config import SchedulerConfig, plugin_config
+from .log import logger
+
+
+class SchedulerRejected(Exception):
+    """请求被调度器拒绝"""
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+        super().__init__(message)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate / 60  # 每分钟 -> 每秒
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    @property
+    def full(self) -> bool:
+        return self.refill() >= self.burst
+
+
+class _Ticket:
+    def __init__(self, group: str, user: str, future: asyncio.Future[None]) -> None:
+        self.group = group
+        self.user = user
+        self.future = future
+
+
+class RequestScheduler:
+    """在完整处理流程之前排队的调度器
+
+    - 全局、每个群、每个用户同时处理的请求数分别受限
+    - 每个群、每个用户按令牌桶限制请求频率
+    - 各群的排队请求轮流放行, 单个群刷屏不会挤占其他群
+    - 排队请求过多时直接拒绝
+    """
+
+    def __init__(self, config: SchedulerConfig) -> None:
+        self.config = config
+        self._running = 0
+        self._group_running: Counter[str] = Counter()
+        self._user_running: Counter[str] = Counter()
+        self._queues: dict[str, deque[_Ticket]] = {}  # 按轮转顺序排列
+        self._waiting = 0
+        self._buckets: dict[str, TokenBucket] = {}
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def _bucket(self, key: str, rate: float, burst: int) -> TokenBucket:
+        if (bucket := self._buckets.get(key)) is None:
+            if len(self._buckets) >= 4096:
+                # 已经回满的令牌桶和新建的没有区别, 可以丢弃
+                self._buckets = {k: v for k, v in self._buckets.items() if not v.full}
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _take_tokens(self, group: str, user: str) -> bool:
+        buckets = []
+        if self.config.group_rate > 0:
+            buckets.append(self._bucket(f"group:{group}", self.config.group_rate, self.config.group_burst))
+        if self.config.user_rate > 0:
+            buckets.append(self._bucket(f"user:{user}", self.config.user_rate, self.config.user_burst))
+        if any(bucket.refill() < 1 for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return True
+
+    def _eligible(self, ticket: _Ticket) -> bool:
+        return (
+            self._group_running[ticket.group] < self.config.group_concurrency
+            and self._user_running[ticket.user] < self.config.user_concurrency
+        )
+
+    def _dispatch(self) -> None:
+        while self._running < self.config.max_concurrency:
+            for queue in self._queues.values():
+                if (ticket := next((ticket for ticket in queue if self._eligible(ticket)), None)) is not None:
+                    break
+            else:
+                return
+
+            queue.remove(ticket)
+            self._waiting -= 1
+            # 放行后该群移到队尾, 轮到其他群
+            del self._queues[ticket.group]
+            if queue:
+                self._queues[ticket.group] = queue
+
+            self._running += 1
+            self._group_running[ticket.group] += 1
+            self._user_running[ticket.user] += 1
+            ticket.future.set_result(None)
+
+    def _position(self, ticket: _Ticket) -> int:
+        """按轮转顺序估算排在该请求前面的请求数, 不考虑群和用户的并发限制"""
+        rounds = self._queues[ticket.group].index(ticket)
+        ahead = rounds
+        before = True
+        for group, queue in self._queues.items():
+            if group == ticket.group:
+                before = False
+                continue
+            # 轮转顺序在前的群每轮都先放行一个, 在后的群只在之前的轮次中放行
+            ahead += min(len(queue), rounds + 1 if before else rounds)
+        return ahead
+
+    def _release(self, ticket: _Ticket) -> None:
+        self._running -= 1
+        self._group_running[ticket.group] -= 1
+        self._user_running[ticket.user] -= 1
+        if not self._group_running[ticket.group]:
+            del self._group_running[ticket.group]
+        if not self._user_running[ticket.user]:
+            del self._user_running[ticket.user]
+        self._dispatch()
+
+    def _withdraw(self, ticket: _Ticket) -> None:
+        if (queue := self._queues.get(ticket.group)) is not None and ticket in queue:
+            queue.remove(ticket)
+            self._waiting -= 1
+            if not queue:
+                del self._queues[ticket.group]
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        group: str,
+        user: str,
+        on_queued: Callable[[int], Awaitable[None]] | None = None,
+    ) -> AsyncGenerator[None, None]:
+        """等待轮到该请求, 被拒绝时抛出 `SchedulerRejected`
+
+        Args:
+            group: 群或私聊的标识
+            user: 用户标识
+            on_queued: 需要排队时调用, 参数为按轮转顺序估算的前面等待的请求数
+        """
+        # 先检查队列, 因队列已满被拒绝的请求不消耗令牌
+        if self._waiting >= self.config.queue_size:
+            logger.warning(f"排队请求已达上限 {self.config.queue_size}, 已拒绝: 群 {group}, 用户 {user}")
+            raise SchedulerRejected("当前请求过多, 请稍后再试")
+        if not self._take_tokens(group, user):
+            logger.info(f"请求过于频繁, 已拒绝: 群 {group}, 用户 {user}")
+            raise SchedulerRejected("请求过于频繁, 请稍后再试")
+
+        ticket = _Ticket(group, user, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(group, deque()).append(ticket)
+        self._waiting += 1
+        self._dispatch()
+
+        if not ticket.future.done():
+            ahead = self._position(ticket)
+            logger.info(
+                f"请求排队中: 群 {group}, 用户 {user}, 前面约有 {ahead} 个请求, 共 {self._waiting} 个排队, 处理中 {self._running} 个"
+            )
+            try:
+                if on_queued is not None:
+                    with contextlib.suppress(Exception):
+                        await on_queued(ahead)
+                await ticket.future
+            except BaseException:
+                # 放行后才被取消时要归还名额
+                if ticket.future.done() and not ticket.future.cancelled():
+                    self._release(ticket)
+                else:
+                    self._withdraw(ticket)
+                raise
+
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+
+scheduler = RequestScheduler(plugin_config.scheduler)
@@ -0,0 +1,90 @@
+import math
+import re
+from functools import cache
+from typing import Any
+
+from .config import plugin_config
+from .log import logger
+
+config = plugin_config.prompt
+
+# 中日韩文字大约每个字一个 token, 其余文字大约每 4 个字符一个 token
+PATTERN_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    other = len(PATTERN_CJK.sub("", text))
+    return len(text) - other + math.ceil(other / 4)
+
+
+def _truncate_estimated(text: str, max_tokens: int) -> str:
+    low, high = 0, min(len(text), max_tokens * 4)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """截取不超过 max_tokens 个 token 的最长前缀"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return _truncate_estimated(text, max_tokens)
+
+
+@cache
+def _get_encoding() -> Any | None:
+    if config.tokenizer != "tiktoken":
+        return None
+
+    try:
+        import tiktoken  # type: ignore
+    except ImportError:
+        logger.warning("未安装 tiktoken, 改用估算的 token 数")
+        return None
+
+    try:
+        return tiktoken.get_encoding(config.encoding)
+    except Exception:
+        logger.exception(f"加载 tiktoken 编码失败: {config.encoding}, 改用估算的 token 数")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """按配置的分词方式计算 token 数"""
+    if (encoding := _get_encoding()) is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按配置的分词方式截取不超过 max_tokens 个 token 的最长前缀"""
+    if (encoding := _get_encoding()) is None:
+        return truncate_tokens(text, max_tokens)
+    if max_tokens <= 0:
+        return ""
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    # 截断处可能落在多字节字符中间, 丢弃不完整的字符
+    return encoding.decode_bytes(tokens[:max_tokens]).decode("utf-8", errors="ignore")
+
+
+def allocate_budget(sizes: list[int], budget: int) -> list[int]:
+    """把预算平均分给各部分, 用不完的部分让给其余部分"""
+    allocation = [0] * len(sizes)
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    remaining = budget
+    while pending:
+        share = remaining // len(pending)
+        index = pending.pop(0)
+        allocation[index] = min(sizes[index], share)
+        remaining -= allocation[index]
+    return allocation
@@ -0,0 +1,73 @@
+import asyncio
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import ParamSpec, TypeVar
+
+import nonebot
+from nonebot.compat import model_dump
+
+from .config import WorkerConfig, plugin_config
+from .log import logger
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+_pools: list["WorkerPool"] = []
+
+
+def _worker_initializer() -> Callable[[], object]:
+    """子进程在导入插件前先初始化 NoneBot, 插件配置与主进程相同
+
+    `nonebot.init` 在已经初始化过时什么也不做, 主模块(如 bot.py)在子进程中重新执行时也不会冲突
+    """
+    log_level = nonebot.get_driver().config.log_level
+    return partial(nonebot.init, driver="~none", log_level=log_level, zssm=model_dump(plugin_config, by_alias=True))
+
+
+class WorkerPool:
+    """把 CPU 密集的同步函数放到线程/进程池中执行
+
+    同时执行和排队的任务总数受 `max_workers + queue_size` 限制, 超出时调用方会等待, 形成背压
+    """
+
+    def __init__(self, name: str, config: WorkerConfig) -> None:
+        self.name = name
+        self.config = config
+        self._executor: Executor | None = None
+        self._slots = asyncio.Semaphore(config.max_workers + config.queue_size)
+        _pools.append(self)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is not None:
+            return self._executor
+
+        if self.config.type == "process":
+            # 不使用 fork: 此时已有事件循环、HTTP 连接池、浏览器驱动等线程, fork 会把它们持有的锁一起复制到子进程
+            self._executor = ProcessPoolExecutor(
+                self.config.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_worker_initializer(),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(self.config.max_workers, thread_name_prefix=f"zssm-{self.name}")
+        return self._executor
+
+    async def run(self, func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
+        if self._slots.locked():
+            logger.debug(f"{self.name}: 任务队列已满, 等待空闲")
+
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), partial(func, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+async def shutdown_pools() -> None:
+    for pool in _pools:
+        pool.shutdown()